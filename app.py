@@ -1,22 +1,51 @@
+import io
 import os
+import socket
+import math
+import random
+import base64
 import uuid
+import hashlib
 import time
+import shutil
+import tempfile
 import subprocess
 import signal
 import sys
 import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import psutil
-from datetime import datetime, timedelta
-from threading import Thread
-from queue import Queue
+from collections import deque, OrderedDict
+from datetime import datetime
+from threading import Thread, Lock, Event, local
+from queue import Queue, Empty, Full
+from concurrent.futures import Future
 import json
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from playwright.sync_api import sync_playwright
+from flask import Flask, Response, request, jsonify, g, send_from_directory
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+
+# Optional faster JSON encoder/decoder for the API hot path
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional dependencies for server-side tile classification
+try:
+    import numpy as np
+    import onnxruntime as ort
+    from PIL import Image
+except ImportError:
+    np = None
+    ort = None
+    Image = None
 
 # Global variables for processes and cleanup
-xvfb_process = None
+display_manager = None
+cpu_placement = None
 vnc_process = None
 all_child_processes = []
 
@@ -28,57 +57,761 @@ app = Flask(__name__)
 # Configuration from environment variables
 PORT = int(os.getenv('PORT', '3000'))
 PORT_VNC = int(os.getenv('PORT_VNC', '5900'))
-VALID_API_KEYS = os.getenv('VALID_API_KEYS', '123456789').split(',')
+VALID_API_KEYS = frozenset(key.strip() for key in os.getenv('VALID_API_KEYS', '123456789').split(',') if key.strip())
 DEFAULT_RECAPTCHA_URL = os.getenv('DEFAULT_RECAPTCHA_URL', 'https://www.google.com/recaptcha/api2/demo')
 DEFAULT_RECAPTCHA_SITEKEY = os.getenv('DEFAULT_RECAPTCHA_SITEKEY', '6Le-wvkSAAAAAPBMRTvw0Q4Muexq9bi0DJwx_mJ-')
 DEFAULT_HEADLESS = os.getenv('DEFAULT_HEADLESS', 'false').lower() == 'true'
 DEFAULT_INCOGNITO = os.getenv('DEFAULT_INCOGNITO', 'true').lower() == 'true'
+XVFB_DISPLAYS = int(os.getenv('XVFB_DISPLAYS', '1'))
+XVFB_BASE_DISPLAY = int(os.getenv('XVFB_BASE_DISPLAY', '99'))
+XVFB_SCREEN = os.getenv('XVFB_SCREEN', '1280x720x24')
+BROWSERS_PER_DISPLAY = int(os.getenv('BROWSERS_PER_DISPLAY', '0'))  # 0 = round-robin
+BROWSER_VIEWPORT = os.getenv('BROWSER_VIEWPORT', '1280x720')
 MAX_PARALLEL_TASKS = int(os.getenv('MAX_PARALLEL_TASKS', '5'))
+# 'browser' solves with Chromium; 'stub' fakes solves to load-test the API and queue alone
+SOLVER_BACKEND = os.getenv('SOLVER_BACKEND', 'browser').lower()
+STUB_LATENCY_MEDIAN = float(os.getenv('STUB_LATENCY_MEDIAN', '15'))  # Seconds
+STUB_LATENCY_SIGMA = float(os.getenv('STUB_LATENCY_SIGMA', '0.5'))  # Log-normal shape, 0 = constant
+STUB_FAILURE_RATE = float(os.getenv('STUB_FAILURE_RATE', '0.05'))
+# Cluster mode: '' runs standalone, 'local' or 'redis' share the queue and results between nodes
+# Shutdown: seconds to let running solves finish, and where the standalone queue is saved for the next process
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', '60'))
+QUEUE_STATE_PATH = os.getenv('QUEUE_STATE_PATH', os.path.join(tempfile.gettempdir(), 'recaptcha-solver-queue-state.json'))
+CLUSTER_BACKEND = os.getenv('CLUSTER_BACKEND', '').lower()
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+CLUSTER_PREFIX = os.getenv('CLUSTER_PREFIX', 'recaptcha')
+NODE_ID = os.getenv('NODE_ID', f"{socket.gethostname()}-{os.getpid()}")
+NODE_HEARTBEAT_TTL = int(os.getenv('NODE_HEARTBEAT_TTL', '15'))  # Seconds without a heartbeat before a node counts as dead
+WARM_PAGES_MAX = int(os.getenv('WARM_PAGES_MAX', '2'))  # 0 disables pre-warmed pages
+WARM_PAGES_MIN_REQUESTS = int(os.getenv('WARM_PAGES_MIN_REQUESTS', '3'))
+WARM_PAGE_MAX_AGE = int(os.getenv('WARM_PAGE_MAX_AGE', '300'))  # Seconds before a ready page is rebuilt
+WARM_PAGES_MIN_FREE_MB = int(os.getenv('WARM_PAGES_MIN_FREE_MB', '1024'))
+TASK_TTL = int(os.getenv('TASK_TTL', '3600'))  # Seconds a task result is kept
+TASK_STORE_MAX = int(os.getenv('TASK_STORE_MAX', '200000'))  # Oldest finished tasks are evicted beyond this
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '600'))  # Seconds a repeated idempotencyKey returns the same task
 RETRY_COUNT = int(os.getenv('RETRY_COUNT', '3'))
 RETRY_DELAY = int(os.getenv('RETRY_DELAY', '5000'))
 PAGE_LOAD_TIMEOUT = int(os.getenv('PAGE_LOAD_TIMEOUT', '30000'))
-PROXY_SERVER = int(os.getenv('PROXY_SERVER', '5.79.73.131:13010'))
+USE_PROXY = os.getenv('USE_PROXY', 'true').lower() == 'true'
+PROXY_SERVER = os.getenv('PROXY_SERVER', '5.79.73.131:13010')
+PROXY_USERNAME = os.getenv('PROXY_USERNAME', '')
+PROXY_PASSWORD = os.getenv('PROXY_PASSWORD', '')
 
-# Store for tasks
-task_store: Dict[str, Dict[str, Any]] = {}
+# Browser profile settings
+EXTENSION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libs", "rektCaptcha")
+USE_PROFILE_TEMPLATE = os.getenv('USE_PROFILE_TEMPLATE', 'true').lower() == 'true'
+PROFILE_TEMPLATE_DIR = os.getenv('PROFILE_TEMPLATE_DIR', os.path.join(tempfile.gettempdir(), 'recaptcha-solver-template'))
+# Each clone holds a full profile and HTTP cache. /dev/shm avoids the disk but is only
+# 64MB in a default container (hence --disable-dev-shm-usage), so it is opt-in
+PROFILE_CLONE_DIR = os.getenv('PROFILE_CLONE_DIR', tempfile.gettempdir())
+
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Server-side tile classification with the extension's models (needs numpy, onnxruntime, Pillow)
+SERVER_CLASSIFICATION = os.getenv('SERVER_CLASSIFICATION', 'true').lower() == 'true' and ort is not None
+CLASSIFIER_BATCH_SIZE = int(os.getenv('CLASSIFIER_BATCH_SIZE', '16'))
+CLASSIFIER_BATCH_WAIT_MS = int(os.getenv('CLASSIFIER_BATCH_WAIT_MS', '15'))
+CLASSIFIER_THREADS = int(os.getenv('CLASSIFIER_THREADS', '0'))
+TILE_CACHE_SIZE = int(os.getenv('TILE_CACHE_SIZE', '50000'))
+TILE_CACHE_PATH = os.getenv('TILE_CACHE_PATH', '')  # Empty keeps the cache in memory only
+# Image challenges (including reloads) handled per attempt before waiting on the token
+CHALLENGE_MAX_ROUNDS = int(os.getenv('CHALLENGE_MAX_ROUNDS', '10'))
+
+# CPU placement: browsers are pinned away from the first API_RESERVED_CORES cores and deprioritized (Linux)
+CPU_PLACEMENT = os.getenv('CPU_PLACEMENT', 'false').lower() == 'true'
+API_RESERVED_CORES = int(os.getenv('API_RESERVED_CORES', '1'))
+BROWSER_NICE = int(os.getenv('BROWSER_NICE', '10'))
+BROWSER_IO_PRIORITY = os.getenv('BROWSER_IO_PRIORITY', 'low').lower()  # low, idle or normal
+
+# Per (url, sitekey) solve statistics: EWMA smoothing, pairs kept, and optional JSON file saved every minute
+STATS_EWMA_ALPHA = float(os.getenv('STATS_EWMA_ALPHA', '0.2'))
+STATS_MAX_PAIRS = int(os.getenv('STATS_MAX_PAIRS', '10000'))
+STATS_PATH = os.getenv('STATS_PATH', '')
+
+# Playwright traces (actions, network, screenshots, DOM snapshots) for failed, slow and sampled tasks.
+# Empty TRACE_DIR disables tracing; the directory is a ring buffer capped at TRACE_DIR_MAX_MB
+TRACE_DIR = os.getenv('TRACE_DIR', '')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '60'))
+TRACE_DIR_MAX_MB = int(os.getenv('TRACE_DIR_MAX_MB', '500'))
+
+# Logging: level, share of sampled debug lines that are kept, and records buffered before dropping
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.05'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Same defaults background.js writes to chrome.storage on first install
+EXTENSION_STORAGE_DEFAULTS = {
+    'recaptcha_auto_open': 1,
+    'recaptcha_auto_solve': 1,
+    'recaptcha_click_delay_time': 200,
+    'recaptcha_solve_delay_time': 100
+}
+
+# Logging
+log = logging.getLogger('recaptcha_solver')
+# Task ID and solve stage of whatever the current thread is working on
+log_context = local()
+
+def set_log_context(task_id: Optional[str] = None, stage: Optional[str] = None):
+    log_context.task_id = task_id
+    log_context.stage = stage
+
+def set_log_stage(stage: Optional[str]):
+    log_context.stage = stage
+
+def get_log_context() -> Dict[str, Optional[str]]:
+    return {'task_id': getattr(log_context, 'task_id', None), 'stage': getattr(log_context, 'stage', None)}
+
+class LogContextFilter(logging.Filter):
+    """Stamps records with the calling thread's task context before they leave the thread"""
+    def filter(self, record):
+        task_id = getattr(log_context, 'task_id', None)
+        stage = getattr(log_context, 'stage', None)
+        if task_id:
+            record.context = f"[{task_id[:8]}{'/' + stage if stage else ''}] "
+        else:
+            record.context = ''
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the writer thread falls behind, records are dropped and counted"""
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
 
-# Start Xvfb virtual display
-def start_xvfb():
-    # Check if this is the reloader process in Flask
-    is_reloader = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+def setup_logging():
+    """Route every logger (including werkzeug's) through a queue drained by one writer thread"""
+    global log_handler, log_listener
+    if log_listener:
+        return log_handler, log_listener
     
-    # Check if Xvfb is already running on display :99
-    if os.path.exists("/tmp/.X99-lock"):
-        print("Xvfb is already running on display :99, reusing it")
-        os.environ['DISPLAY'] = ':99'
-        return None
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(context)s%(message)s'))
+    handler = DroppingQueueHandler(Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(LogContextFilter())
+    
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
     
-    # Only start Xvfb in the main process or if it's not already running
-    if not is_reloader or not os.path.exists("/tmp/.X99-lock"):
-        # Start a new Xvfb instance with stderr redirected to /dev/null to suppress warnings
-        print("Starting Xvfb virtual display...")
-        xvfb_process = subprocess.Popen(
-            "Xvfb :99 -screen 0 1920x1080x24 2>/dev/null", 
-            shell=True
+    listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    log_handler, log_listener = handler, listener
+    # Registered before any other exit hook, so it runs last and flushes everything they log
+    atexit.register(flush_logs)
+    return handler, listener
+
+def log_sampled(message: str, *args):
+    """Debug line for hot loops, kept for LOG_SAMPLE_RATE of calls; free when debug is off"""
+    if log.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        log.debug(message, *args)
+
+def flush_logs():
+    """Write out queued records, for exit paths that skip atexit"""
+    # Safe to call more than once: stop() on a stopped listener would fail
+    if log_listener and log_listener._thread:
+        log_listener.stop()
+
+# Set by setup_logging, which create_app (or a benchmark) calls; importing app leaves logging alone
+log_handler = None
+log_listener = None
+
+# Store for tasks
+class TaskRecord:
+    __slots__ = ('status', 'created', 'client_key', 'token', 'error', 'solve_time', 'trace', 'fetched')
+
+    def __init__(self, client_key: Optional[str]):
+        self.status = 'processing'
+        self.created = time.monotonic()
+        self.client_key = client_key
+        self.token = None
+        self.error = None
+        self.solve_time = None
+        self.trace = None
+        # Set once getTaskResult has returned the final result
+        self.fetched = False
+
+    @property
+    def elapsed(self) -> float:
+        return round(time.monotonic() - self.created, 2)
+
+class TaskStoreFull(Exception):
+    """Raised by TaskStore.add when every stored task is still processing"""
+
+class TaskStore:
+    """Task records plus an insertion-ordered expiry index.
+
+    Tasks all live for the same TTL, so creation order is expiry order:
+    expire() only ever looks at the front of the index and costs O(expired).
+    """
+    def __init__(self, ttl: float, max_tasks: int):
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self.lock = Lock()
+        self.tasks: Dict[str, TaskRecord] = {}
+        self.order = deque()
+        self.evicted = 0
+        # Records still 'processing'; these are never evicted to make room
+        self.in_flight = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def add(self, task_id: str, client_key: Optional[str]) -> TaskRecord:
+        record = TaskRecord(client_key)
+        with self.lock:
+            # Hard cap on memory: drop the oldest finished tasks first
+            if len(self.tasks) >= self.max_tasks:
+                if self.in_flight >= self.max_tasks:
+                    raise TaskStoreFull('Too many tasks in progress')
+                self._evict_finished(len(self.tasks) - self.max_tasks + 1)
+            self.tasks[task_id] = record
+            self.order.append(task_id)
+            self.in_flight += 1
+        return record
+
+    def _evict_finished(self, count: int):
+        # Tasks still processing keep their place at the front of the index
+        kept = []
+        while count > 0 and self.order:
+            task_id = self.order.popleft()
+            record = self.tasks.get(task_id)
+            if record is None:
+                continue
+            if record.status == 'processing':
+                kept.append(task_id)
+                continue
+            del self.tasks[task_id]
+            self.evicted += 1
+            count -= 1
+        self.order.extendleft(reversed(kept))
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self.tasks.get(task_id)
+
+    def update(self, task_id: str, status: str, **fields):
+        # Under the lock, so expire() and pop() never count the same record out twice
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                raise ValueError('Task not found')
+
+            if task.status == 'processing' and status != 'processing':
+                self.in_flight -= 1
+            task.status = status
+            for name, value in fields.items():
+                setattr(task, name, value)
+
+    def pop(self, task_id: str):
+        with self.lock:
+            record = self.tasks.pop(task_id, None)
+            if record is not None and record.status == 'processing':
+                self.in_flight -= 1
+
+    def is_expired(self, record: TaskRecord) -> bool:
+        return time.monotonic() - record.created > self.ttl
+
+    def expire(self, max_steps: int = 10000) -> int:
+        cutoff = time.monotonic() - self.ttl
+        removed = 0
+        with self.lock:
+            while self.order and removed < max_steps:
+                record = self.tasks.get(self.order[0])
+                if record is not None and record.created > cutoff:
+                    break
+                task_id = self.order.popleft()
+                if record is not None:
+                    del self.tasks[task_id]
+                    if record.status == 'processing':
+                        self.in_flight -= 1
+                    removed += 1
+        return removed
+
+    def values(self):
+        return list(self.tasks.values())
+
+task_store = TaskStore(TASK_TTL, TASK_STORE_MAX)
+
+class IdempotencyIndex:
+    """Maps (clientKey, idempotencyKey) to the task it created, for IDEMPOTENCY_TTL seconds.
+
+    Same layout as TaskStore: one TTL for every entry, so insertion order is
+    expiry order and expire() only looks at the front.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = Lock()
+        # Key -> (task ID, request fingerprint, claim time)
+        self.entries: Dict[Tuple[str, str], Tuple[str, str, float]] = {}
+        self.order = deque()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def claim(self, key: Tuple[str, str], task_id: str, fingerprint: str, is_live) -> Optional[Tuple[str, str]]:
+        """Record task_id for key unless a live task already holds it; returns that task and its fingerprint"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] <= self.ttl and is_live(entry[0]):
+                return entry[0], entry[1]
+            now = time.monotonic()
+            self.entries[key] = (task_id, fingerprint, now)
+            self.order.append((key, now))
+        return None
+
+    def expire(self, max_steps: int = 10000) -> int:
+        cutoff = time.monotonic() - self.ttl
+        removed = 0
+        with self.lock:
+            while self.order and self.order[0][1] <= cutoff and removed < max_steps:
+                key, claimed = self.order.popleft()
+                # A key claimed again since has a newer entry further back in the index
+                entry = self.entries.get(key)
+                if entry is not None and entry[2] == claimed:
+                    del self.entries[key]
+                    removed += 1
+        return removed
+
+idempotency_index = IdempotencyIndex(IDEMPOTENCY_TTL)
+
+# Timing and counter metrics, reported by /health
+class Metrics:
+    def __init__(self, window=500):
+        self.lock = Lock()
+        self.window = window
+        self.timings: Dict[str, deque] = {}
+        self.counters: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = deque(maxlen=self.window)
+            self.timings[name].append(seconds)
+
+    def incr(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            timings = {name: sorted(values) for name, values in self.timings.items()}
+            counters = dict(self.counters)
+
+        summary = {}
+        for name, values in timings.items():
+            if not values:
+                continue
+            summary[name] = {
+                'count': len(values),
+                'avg': round(sum(values) / len(values), 3),
+                'p50': round(values[len(values) // 2], 3),
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                'max': round(values[-1], 3)
+            }
+        return {'timings': summary, 'counters': counters}
+
+metrics = Metrics()
+
+# Playwright driver round trips made by the current thread
+rpc_counter = local()
+
+def install_rpc_counter() -> bool:
+    """Count every message sent to the Playwright driver, per thread.
+
+    The sync API drives its connection from the calling thread, so a
+    thread-local counter attributes each round trip to the task making it.
+    This hooks a Playwright internal; if it moves, counting is skipped.
+    """
+    try:
+        from playwright._impl._connection import Connection
+        send = Connection._send_message_to_server
+    except (ImportError, AttributeError):
+        return False
+
+    def counting_send(self, *args, **kwargs):
+        rpc_counter.count = getattr(rpc_counter, 'count', 0) + 1
+        return send(self, *args, **kwargs)
+
+    Connection._send_message_to_server = counting_send
+    return True
+
+def reset_rpc_count():
+    rpc_counter.count = 0
+
+def rpc_count() -> int:
+    return getattr(rpc_counter, 'count', 0)
+
+# Set by create_app, which installs the counter; importing app leaves Playwright untouched
+rpc_counting = False
+
+# Per-sitekey statistics
+class PairStats:
+    __slots__ = ('requests', 'latency', 'success_rate', 'challenge_rate', 'retry_rate', 'last_seen')
+
+    def __init__(self):
+        self.requests = 0
+        self.latency = None
+        self.success_rate = None
+        self.challenge_rate = None
+        self.retry_rate = None
+        self.last_seen = 0.0
+
+    def update(self, alpha: float, latency: float, success: bool, challenged: bool, retried: bool):
+        self.requests += 1
+        self.last_seen = time.time()
+        # The first solve seeds every average, later ones move it by alpha
+        weight = 1.0 if self.requests == 1 else alpha
+        self.latency = ewma(self.latency, latency, weight)
+        self.success_rate = ewma(self.success_rate, float(success), weight)
+        self.challenge_rate = ewma(self.challenge_rate, float(challenged), weight)
+        self.retry_rate = ewma(self.retry_rate, float(retried), weight)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'latency': round(self.latency, 2),
+            'successRate': round(self.success_rate, 3),
+            'challengeRate': round(self.challenge_rate, 3),
+            'retryRate': round(self.retry_rate, 3),
+            'lastSeen': round(self.last_seen)
+        }
+
+def ewma(current: Optional[float], value: float, weight: float) -> float:
+    return value if current is None else current + weight * (value - current)
+
+class SitekeyStatsIndex:
+    """EWMA latency, success, challenge and retry rates per (url, sitekey), least recently seen pairs evicted first"""
+    def __init__(self, alpha=0.2, max_pairs=10000, path=''):
+        self.alpha = alpha
+        self.max_pairs = max_pairs
+        self.path = path
+        self.pairs: 'OrderedDict[Tuple[str, str], PairStats]' = OrderedDict()
+        # Every pair together, for ETAs of pairs not seen yet
+        self.overall = PairStats()
+        self.lock = Lock()
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def record(self, url: str, sitekey: str, latency: float, success: bool, challenged: bool, retried: bool):
+        with self.lock:
+            key = (url, sitekey)
+            stats = self.pairs.get(key)
+            if stats is None:
+                stats = self.pairs[key] = PairStats()
+                if len(self.pairs) > self.max_pairs:
+                    self.pairs.popitem(last=False)
+            else:
+                self.pairs.move_to_end(key)
+            stats.update(self.alpha, latency, success, challenged, retried)
+            self.overall.update(self.alpha, latency, success, challenged, retried)
+            self.dirty = True
+
+    def latency(self, url: str, sitekey: str) -> Optional[float]:
+        stats = self.pairs.get((url, sitekey))
+        return stats.latency if stats else self.overall.latency
+
+    def eta(self, url: str, sitekey: str, waiting: int, max_parallel: int) -> Optional[float]:
+        """Expected seconds until a task submitted now is solved, given how many are ahead of it"""
+        latency = self.latency(url, sitekey)
+        if latency is None:
+            return None
+        # Tasks ahead beyond the free slots drain at max_parallel per average solve
+        queue_wait = max(0, waiting - max_parallel + 1) * (self.overall.latency or latency) / max(1, max_parallel)
+        return round(queue_wait + latency, 1)
+
+    def snapshot(self, sort: str = 'requests', limit: int = 100) -> Dict[str, Any]:
+        keys = {
+            'requests': lambda item: item[1].requests,
+            'latency': lambda item: item[1].latency,
+            'failures': lambda item: 1 - item[1].success_rate,
+            'challenges': lambda item: item[1].challenge_rate,
+            'retries': lambda item: item[1].retry_rate
+        }
+        with self.lock:
+            pairs = sorted(self.pairs.items(), key=keys.get(sort, keys['requests']), reverse=True)[:limit]
+            return {
+                'overall': self.overall.to_dict() if self.overall.requests else None,
+                'pairCount': len(self.pairs),
+                'pairs': [{'url': url, 'sitekey': sitekey, **stats.to_dict()} for (url, sitekey), stats in pairs]
+            }
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        with self.lock:
+            state = {
+                'overall': [getattr(self.overall, name) for name in PairStats.__slots__],
+                'pairs': [[url, sitekey] + [getattr(stats, name) for name in PairStats.__slots__]
+                          for (url, sitekey), stats in self.pairs.items()]
+            }
+            self.dirty = False
+            self.saved_at = time.monotonic()
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def maybe_save(self, interval: float = 60):
+        if time.monotonic() - self.saved_at >= interval:
+            self.save()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            restore = lambda values: self._restore(PairStats(), values)
+            with self.lock:
+                self.overall = restore(state['overall'])
+                for entry in state['pairs'][-self.max_pairs:]:
+                    self.pairs[(entry[0], entry[1])] = restore(entry[2:])
+            log.info("Loaded solve statistics for %s (url, sitekey) pairs", len(self.pairs))
+        except Exception as e:
+            log.warning("Ignoring unreadable statistics file %s: %s", self.path, e)
+
+    @staticmethod
+    def _restore(stats: PairStats, values: List) -> PairStats:
+        for name, value in zip(PairStats.__slots__, values):
+            setattr(stats, name, value)
+        return stats
+
+sitekey_stats = SitekeyStatsIndex(STATS_EWMA_ALPHA, STATS_MAX_PAIRS, STATS_PATH)
+
+# Pool of Xvfb virtual displays for headful browsers
+class DisplayManager:
+    """Runs one or more Xvfb servers and spreads browsers across them.
+
+    With browsers_per_display set, a browser goes to the least loaded display
+    that still has room; otherwise displays are handed out round-robin. A
+    watchdog restarts any display whose Xvfb process has died.
+    """
+    def __init__(self, count=1, base_display=99, screen='1280x720x24', browsers_per_display=0):
+        self.numbers = [base_display + i for i in range(max(1, count))]
+        self.screen = screen
+        self.browsers_per_display = browsers_per_display
+        self.lock = Lock()
+        self.processes: Dict[int, Any] = {}
+        # Kept per display: cpu_percent measures the interval since the previous call on the same object
+        self.monitors: Dict[int, Any] = {}
+        self.load = {number: 0 for number in self.numbers}
+        self.restarts = {number: 0 for number in self.numbers}
+        self.next_index = 0
+
+    @property
+    def primary(self) -> str:
+        return f":{self.numbers[0]}"
+
+    def start(self):
+        for number in self.numbers:
+            self._start_display(number)
+        Thread(target=self._watch_displays, daemon=True).start()
+
+    def _start_display(self, number: int):
+        # Reuse a display that is already running (e.g. left by a previous run)
+        if number not in self.processes and self._accepts_connections(number):
+            log.info("Xvfb is already running on display :%s, reusing it", number)
+            self.processes[number] = None
+            return
+
+        # A killed Xvfb leaves its lock file and socket behind
+        for path in (f"/tmp/.X{number}-lock", f"/tmp/.X11-unix/X{number}"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        log.info("Starting Xvfb virtual display :%s (%s)...", number, self.screen)
+        process = subprocess.Popen(
+            ['Xvfb', f':{number}', '-screen', '0', self.screen, '-nolisten', 'tcp'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
         )
-        os.environ['DISPLAY'] = ':99'
-        print("Xvfb started, DISPLAY set to :99")
-        
-        # Register cleanup function
-        def cleanup_xvfb():
-            if xvfb_process:
-                print("Terminating Xvfb...")
+        self.processes[number] = process
+        try:
+            self.monitors[number] = psutil.Process(process.pid)
+            self.monitors[number].cpu_percent(interval=None)
+        except psutil.Error:
+            self.monitors.pop(number, None)
+        self._wait_for_socket(number, process)
+
+    def _accepts_connections(self, number: int) -> bool:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(1)
+        try:
+            client.connect(f"/tmp/.X11-unix/X{number}")
+            return True
+        except OSError:
+            return False
+        finally:
+            client.close()
+
+    def _wait_for_socket(self, number: int, process, timeout: float = 10):
+        # Browsers launched before Xvfb listens fail to open the display
+        deadline = time.monotonic() + timeout
+        while not self._accepts_connections(number):
+            if process.poll() is not None:
+                log.error("Xvfb on display :%s exited with code %s", number, process.returncode)
+                return False
+            if time.monotonic() >= deadline:
+                log.warning("Xvfb on display :%s is not accepting connections after %ss", number, timeout)
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _watch_displays(self):
+        while True:
+            time.sleep(5)
+            with self.lock:
+                # A display missing from processes failed to restart last time
+                dead = [number for number in self.numbers
+                        if number not in self.processes
+                        or (self.processes[number] is not None and self.processes[number].poll() is not None)]
+                for number in dead:
+                    self.processes.pop(number, None)
+
+            # Starting waits up to 10s for the socket; acquire() and stats() must not block on it
+            for number in dead:
+                log.warning("Xvfb on display :%s is not running, restarting it", number)
                 try:
-                    xvfb_process.terminate()
-                    xvfb_process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    xvfb_process.kill()
-                print("Xvfb terminated")
-        
-        atexit.register(cleanup_xvfb)
-        return xvfb_process
-    
-    return None
+                    self._start_display(number)
+                except Exception as e:
+                    log.error("Could not restart Xvfb on display :%s: %s", number, e)
+                    continue
+                with self.lock:
+                    self.restarts[number] += 1
+
+    def acquire(self) -> str:
+        with self.lock:
+            if self.browsers_per_display > 0:
+                number = min(self.numbers, key=lambda n: self.load[n])
+                if self.load[number] >= self.browsers_per_display:
+                    log.warning("All displays have %s browsers, overcommitting :%s", self.browsers_per_display, number)
+            else:
+                number = self.numbers[self.next_index % len(self.numbers)]
+                self.next_index += 1
+            self.load[number] += 1
+            return f":{number}"
+
+    def release(self, display: str):
+        with self.lock:
+            number = int(display.lstrip(':'))
+            self.load[number] = max(0, self.load[number] - 1)
+
+    def stop(self):
+        for number, process in self.processes.items():
+            if process is None:
+                continue
+            try:
+                process.terminate()
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.info("Terminated Xvfb on display :%s", number)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        results = []
+        with self.lock:
+            for number in self.numbers:
+                process = self.processes.get(number)
+                monitor = self.monitors.get(number)
+                cpu_percent = None
+                if process is not None and process.poll() is None and monitor is not None:
+                    try:
+                        cpu_percent = monitor.cpu_percent(interval=None)
+                    except psutil.Error:
+                        pass
+                results.append({
+                    'display': f":{number}",
+                    # None means a display we reused but did not start
+                    'running': number in self.processes and (process is None or process.poll() is None),
+                    'browsers': self.load[number],
+                    'restarts': self.restarts[number],
+                    # Since the previous /health call
+                    'cpuPercent': cpu_percent
+                })
+        return results
+
+# CPU placement for browser process trees
+class CpuPlacement:
+    """Pins each browser's process tree to its own group of cores, away from the API.
+
+    The first reserved cores are left to the Flask and queue threads; the rest
+    are split into one group per parallel solve. A browser is found by a marker
+    in its environment, which every Chromium child process inherits, and
+    processes it forks later inherit the affinity and priority as well.
+    """
+    ENV_MARKER = 'RECAPTCHA_SOLVER_SLOT'
+
+    def __init__(self, reserved_cores=1, slots=5, nice=10, io_priority='low'):
+        cores = sorted(psutil.Process().cpu_affinity())
+        self.api_cores = cores[:reserved_cores]
+        browser_cores = cores[reserved_cores:]
+        if not browser_cores:
+            log.warning("Only %s cores available, browsers share them with the API", len(cores))
+            browser_cores = cores
+        group_count = max(1, min(slots, len(browser_cores)))
+        self.groups = [browser_cores[i::group_count] for i in range(group_count)]
+        self.load = [0] * group_count
+        self.nice = nice
+        self.io_priority = io_priority
+        self.lock = Lock()
+        self.pinned = 0
+
+    def acquire(self) -> Tuple[int, str]:
+        """Least loaded core group, plus the marker to put in the browser's environment"""
+        with self.lock:
+            group = self.load.index(min(self.load))
+            self.load[group] += 1
+        return group, uuid.uuid4().hex
+
+    def release(self, group: int):
+        with self.lock:
+            self.load[group] = max(0, self.load[group] - 1)
+
+    def apply(self, group: int, marker: str) -> int:
+        """Pin and deprioritize every process carrying the marker; returns how many were found"""
+        cores = self.groups[group]
+        count = 0
+        for proc in psutil.Process().children(recursive=True):
+            try:
+                if proc.environ().get(self.ENV_MARKER) != marker:
+                    continue
+                proc.cpu_affinity(cores)
+                if self.nice:
+                    proc.nice(self.nice)
+                if self.io_priority == 'low':
+                    proc.ionice(psutil.IOPRIO_CLASS_BE, value=7)
+                elif self.io_priority == 'idle':
+                    proc.ionice(psutil.IOPRIO_CLASS_IDLE)
+                count += 1
+            except psutil.Error:
+                # Short-lived helpers can exit while we look at them
+                continue
+        with self.lock:
+            self.pinned += count
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'apiCores': self.api_cores,
+                'groups': [{'cores': cores, 'browsers': load} for cores, load in zip(self.groups, self.load)],
+                'pinnedProcesses': self.pinned
+            }
+
+def primary_display() -> str:
+    # VNC follows the first display the manager runs, or where it will run
+    return display_manager.primary if display_manager else f":{XVFB_BASE_DISPLAY}"
 
 # Start VNC server
 def start_vnc_server():
@@ -91,36 +824,29 @@ def start_vnc_server():
             stderr=subprocess.PIPE
         )
         if proc.stdout and proc.stdout.decode().strip():
-            print(f"VNC server already running on port {PORT_VNC}, reusing it")
+            log.info("VNC server already running on port %s, reusing it", PORT_VNC)
             return None
     except Exception:
         pass
     
     # Start VNC server
     try:
-        # First make sure x11vnc is installed
-        install_proc = subprocess.run(
-            "which x11vnc || sudo apt-get update && sudo apt-get install -y x11vnc",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        
-        if install_proc.returncode != 0:
-            print(f"Error installing x11vnc: {install_proc.stderr.decode()}")
+        # x11vnc has to be installed with the image, never at runtime
+        if not shutil.which('x11vnc'):
+            log.error("x11vnc is not installed, cannot start VNC server")
             return None
         
-        print("Starting VNC server...")
+        log.info("Starting VNC server...")
         # Run VNC server with options:
-        # -display :99 - connect to Xvfb display 99
+        # -display - connect to the first Xvfb display
         # -forever - keep running after client disconnects
         # -shared - allow multiple clients
         # -rfbport - specify VNC port
         # -nopw - no password
         # -q - quiet output
         # IMPORTANT: Do NOT run in background (-bg) so we can track the process
-        vnc_cmd = f"x11vnc -display :99 -forever -shared -rfbport {PORT_VNC} -nopw"
-        print(f"Running VNC command: {vnc_cmd}")
+        vnc_cmd = f"x11vnc -display {primary_display()} -forever -shared -rfbport {PORT_VNC} -nopw"
+        log.debug("Running VNC command: %s", vnc_cmd)
         
         # Run x11vnc in foreground but in a separate process
         vnc_process = subprocess.Popen(
@@ -130,55 +856,61 @@ def start_vnc_server():
             stderr=subprocess.PIPE
         )
         
-        # Give VNC server a moment to start
-        time.sleep(2)
+        # Give VNC server a moment to start, but stop waiting as soon as it listens
+        deadline = time.time() + 2
+        while time.time() < deadline and vnc_process.poll() is None:
+            if any(conn.laddr.port == PORT_VNC and conn.status == psutil.CONN_LISTEN
+                   for conn in psutil.net_connections(kind='tcp')):
+                break
+            time.sleep(0.1)
         
         # Check if VNC process is actually running
         if vnc_process.poll() is not None:
             # Process has terminated - read error
             stdout, stderr = vnc_process.communicate()
             error_msg = stderr.decode() if stderr else "Unknown error"
-            print(f"VNC failed to start: {error_msg}")
+            log.error("VNC failed to start: %s", error_msg)
             return None
         
-        print(f"VNC server started on port {PORT_VNC}")
+        log.info("VNC server started on port %s", PORT_VNC)
         
         # Register cleanup function
         def cleanup_vnc():
             if vnc_process:
-                print("Terminating VNC server...")
+                log.info("Terminating VNC server...")
                 try:
                     vnc_process.terminate()
                     vnc_process.wait(timeout=5)
                 except subprocess.TimeoutExpired:
                     vnc_process.kill()
-                print("VNC server terminated")
+                log.info("VNC server terminated")
         
         atexit.register(cleanup_vnc)
         return vnc_process
     except Exception as e:
-        print(f"Error starting VNC server: {e}")
+        log.error("Error starting VNC server: %s", e)
         return None
 
 # Function to kill all child processes on exit
 def cleanup_all_processes():
-    print("\nCleaning up all processes...")
+    log.info("Cleaning up all processes...")
     
     # Kill all tracked child processes
     for proc in all_child_processes:
         try:
             proc.terminate()
-            print(f"Terminated process PID: {proc.pid}")
+            log.info("Terminated process PID: %s", proc.pid)
         except Exception as e:
-            print(f"Error terminating process: {e}")
+            log.warning("Error terminating process: %s", e)
     
     # Kill Xvfb if it's running
-    if xvfb_process:
+    if display_manager:
         try:
-            xvfb_process.terminate()
-            print("Terminated Xvfb process")
+            display_manager.stop()
         except Exception as e:
-            print(f"Error terminating Xvfb: {e}")
+            log.warning("Error terminating Xvfb: %s", e)
+    
+    profile_template.remove()
     
     # Find and kill any processes still using our ports
     try:
@@ -193,14 +925,15 @@ def cleanup_all_processes():
             if proc.stdout:
                 pids = proc.stdout.decode().strip().split('\n')
                 for pid in pids:
-                    if pid.strip():
-                        print(f"Killing process {pid} using port {port}")
+                    # Never SIGKILL ourselves, the caller exits with a proper status
+                    if pid.strip() and int(pid) != os.getpid():
+                        log.info("Killing process %s using port %s", pid, port)
                         try:
                             os.kill(int(pid), signal.SIGKILL)  # Using SIGKILL for immediate termination
                         except Exception as e:
-                            print(f"Error killing process {pid}: {e}")
+                            log.warning("Error killing process %s: %s", pid, e)
     except Exception as e:
-        print(f"Error cleaning up port processes: {e}")
+        log.warning("Error cleaning up port processes: %s", e)
     
     # Force kill any remaining zombie processes
     try:
@@ -209,35 +942,27 @@ def cleanup_all_processes():
         for child in children:
             try:
                 child.kill()  # Using kill() instead of terminate() for immediate termination
-                print(f"Terminated child process PID: {child.pid}")
+                log.info("Terminated child process PID: %s", child.pid)
             except Exception as e:
-                print(f"Error terminating child process: {e}")
+                log.warning("Error terminating child process: %s", e)
     except Exception as e:
-        print(f"Error killing child processes: {e}")
+        log.warning("Error killing child processes: %s", e)
     
-    print("Cleanup complete")
-
-# Register cleanup function for normal exit
-atexit.register(cleanup_all_processes)
+    log.info("Cleanup complete")
 
 # Handle signals for graceful shutdown
 def signal_handler(sig, frame):
-    print('\nReceived signal to terminate')
-    cleanup_all_processes()
-    # Force exit - do not rely on other cleanup code
-    os._exit(0)  # Using os._exit to force immediate exit without further cleanup
-
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
-signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
-
-# Check if we need to start Xvfb
-DEFAULT_HEADLESS = os.getenv('DEFAULT_HEADLESS', 'false').lower() == 'true'
-if not DEFAULT_HEADLESS:
-    xvfb_process = start_xvfb()
-    # Start VNC server if Xvfb is running
-    if os.environ.get('DISPLAY') == ':99':
-        vnc_process = start_vnc_server()
+    if draining.is_set() or request_queue is None:
+        log.warning('Received signal to terminate')
+        cleanup_all_processes()
+        # Force exit - do not rely on other cleanup code
+        flush_logs()
+        os._exit(0)  # Using os._exit to force immediate exit without further cleanup
+    
+    # Drain off the main thread so the server keeps answering getTaskResult meanwhile
+    log.warning('Received signal to terminate, draining for up to %ss (signal again to exit now)', DRAIN_TIMEOUT)
+    draining.set()
+    Thread(target=drain_and_exit, args=(DRAIN_TIMEOUT,), daemon=True).start()
 
 # Request Queue implementation
 class RequestQueue:
@@ -245,6 +970,11 @@ class RequestQueue:
         self.queue = Queue()
         self.processing = 0
         self.max_parallel = max_parallel
+        # Called with the task ID once a task has finished, whatever the outcome
+        self.on_task_done = None
+        # Task ID -> (start time, args) for tasks currently executing
+        self.running: Dict[str, Tuple[float, tuple]] = {}
+        self.paused = False
         self.worker_thread = Thread(target=self._process_queue, daemon=True)
         self.worker_thread.start()
 
@@ -253,9 +983,13 @@ class RequestQueue:
     
     def _process_queue(self):
         while True:
-            if self.processing < self.max_parallel and not self.queue.empty():
+            if not self.paused and self.processing < self.max_parallel and not self.queue.empty():
+                try:
+                    task_id, func, args, kwargs = self.queue.get_nowait()
+                except Empty:
+                    continue
                 self.processing += 1
-                task_id, func, args, kwargs = self.queue.get()
+                self.running[task_id] = (time.monotonic(), args)
                 
                 # Execute the task in a separate thread
                 thread = Thread(target=self._execute_task, args=(task_id, func, args, kwargs))
@@ -265,164 +999,143 @@ class RequestQueue:
             time.sleep(0.1)
     
     def _execute_task(self, task_id, func, args, kwargs):
+        set_log_context(task_id, 'start')
         start_time = time.time()
         try:
             result = func(*args, **kwargs)
             elapsed_time = time.time() - start_time
             if result.get('success') == 1:
-                update_task_status(task_id, "ready", {
-                    "gRecaptchaResponse": result.get('gRecaptchaResponse'),
-                    "solveTime": round(elapsed_time, 2)
-                })
+                update_task_status(task_id, "ready",
+                                   token=result.get('gRecaptchaResponse'),
+                                   solve_time=round(elapsed_time, 2),
+                                   trace=result.get('trace'))
             else:
-                update_task_status(task_id, "failed", {
-                    "error": result.get('error', 'Unknown error'),
-                    "solveTime": round(elapsed_time, 2)
-                })
+                update_task_status(task_id, "failed",
+                                   error=result.get('error', 'Unknown error'),
+                                   solve_time=round(elapsed_time, 2),
+                                   trace=result.get('trace'))
+            set_log_stage(None)
+            log.info("Task %s in %.2fs", 'solved' if result.get('success') == 1 else 'failed', elapsed_time)
+            if rpc_counting and 'rpcs' in result:
+                # Driver round trips per solve, to catch regressions in the interaction code
+                metrics.record('task_rpcs', result['rpcs'])
+            url, sitekey = args
+            sitekey_stats.record(url, sitekey, elapsed_time, result.get('success') == 1,
+                                 result.get('challenged', False), result.get('retries', 0) > 0)
         except Exception as e:
             elapsed_time = time.time() - start_time
-            update_task_status(task_id, "failed", {
-                "error": str(e),
-                "solveTime": round(elapsed_time, 2)
-            })
+            set_log_stage(None)
+            log.warning("Task failed in %.2fs: %s", elapsed_time, e)
+            update_task_status(task_id, "failed",
+                               error=str(e),
+                               solve_time=round(elapsed_time, 2))
         finally:
+            set_log_context()
             self.processing -= 1
+            self.running.pop(task_id, None)
+            if self.on_task_done:
+                self.on_task_done(task_id)
+
+    def waiting(self) -> int:
+        """Tasks queued or running, i.e. ahead of a task added now"""
+        return self.processing + self.queue.qsize()
+
+    def has_capacity(self) -> bool:
+        return not self.paused and self.processing + self.queue.qsize() < self.max_parallel
+
+    def pause(self) -> List[tuple]:
+        """Stop starting tasks and return the ones still queued"""
+        self.paused = True
+        queued = []
+        while True:
+            try:
+                queued.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return queued
 
-# Initialize queue
-request_queue = RequestQueue(MAX_PARALLEL_TASKS)
+    def wait_running(self, timeout: float) -> Dict[str, Tuple[float, tuple]]:
+        """Wait up to timeout for running tasks and return the ones still running"""
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            time.sleep(0.2)
+        return dict(self.running)
+
+# Created by create_app
+request_queue = None
 
 # Helper functions
-def update_task_status(task_id: str, status: str, data: Optional[Dict[str, Any]] = None):
-    if task_id not in task_store:
-        raise ValueError('Task not found')
-    
-    task_store[task_id].update({
-        'status': status,
-        **(data or {})
-    })
+def update_task_status(task_id: str, status: str, **fields):
+    try:
+        task_store.update(task_id, status, **fields)
+    except ValueError:
+        # Expired while it ran; there is no record left to hold the result
+        log.warning("Task record gone, dropping its %s result", status)
+
+def parse_json_body() -> Optional[Dict[str, Any]]:
+    body = request.get_data(cache=False)
+    if not body:
+        return None
+    try:
+        data = orjson.loads(body) if orjson else json.loads(body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def json_response(payload: Dict[str, Any], status: int = 200) -> Response:
+    body = orjson.dumps(payload) if orjson else json.dumps(payload, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
 
 def validate_api_key(func):
     def wrapper(*args, **kwargs):
-        data = request.get_json()
+        # The body is parsed once here and shared with the handler through g.json_body
+        data = parse_json_body()
         client_key = data.get('clientKey') if data else None
         
-        if not client_key or client_key not in VALID_API_KEYS:
-            return jsonify({
+        if not isinstance(client_key, str) or client_key not in VALID_API_KEYS:
+            return json_response({
                 'success': 0,
                 'message': 'Invalid API key'
-            }), 401
+            }, 401)
         
+        g.json_body = data
         return func(*args, **kwargs)
     
     wrapper.__name__ = func.__name__
     return wrapper
 
-# reCAPTCHA Solver class
-class RecaptchaSolver:
-    def __init__(self):
-        self.retry_count = RETRY_COUNT
-        self.retry_delay = RETRY_DELAY
+def prepare_extension_files(extension_path):
+    """Create the necessary files for the rektCaptcha extension"""
+    manifest_path = os.path.join(extension_path, "manifest.json")
+    background_path = os.path.join(extension_path, "background.js")
+    content_path = os.path.join(extension_path, "content.js")
     
-    def solve(self, url: str, sitekey: str) -> Dict[str, Any]:
-        with sync_playwright() as playwright:
-            try:
-                browser = self._init_browser(playwright)
-                page = browser.new_page()
-                page._sitekey = sitekey  # Store sitekey for later use
-                
-                print(f"Navigating to {url}")
-                page.goto(url, timeout=PAGE_LOAD_TIMEOUT)
-                print("Page loaded")
-                
-                # Wait a bit after page load
-                page.wait_for_timeout(2000)
-                
-                print("Injecting custom script...")
-                self._inject_custom_script(page, sitekey)
-                
-                print("Handling reCAPTCHA...")
-                recaptcha_token = self._handle_recaptcha(page)
-                
-                return {
-                    'success': 1,
-                    'message': "ready",
-                    'gRecaptchaResponse': recaptcha_token
-                }
-            except Exception as e:
-                print(f"Error in solve: {str(e)}")
-                return {
-                    'success': 0,
-                    'message': "failed",
-                    'error': str(e)
+    # Create manifest.json if it doesn't exist
+    if not os.path.exists(manifest_path):
+        manifest_content = {
+            "name": "rektCaptcha",
+            "version": "1.0",
+            "manifest_version": 3,
+            "description": "Helps solve reCAPTCHA challenges",
+            "permissions": ["activeTab", "scripting"],
+            "background": {
+                "service_worker": "background.js"
+            },
+            "content_scripts": [
+                {
+                    "matches": ["*://*/*"],
+                    "js": ["content.js"],
+                    "all_frames": True
                 }
-            finally:
-                if 'browser' in locals():
-                    browser.close()
-    
-    def _init_browser(self, playwright):
-        # Path to extension directory - adjust as needed for your setup
-        extension_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libs", "rektCaptcha")
-        
-        # Create the extensions directory if it doesn't exist
-        os.makedirs(extension_path, exist_ok=True)
-        
-        # Check if extension files exist, and if not, create them
-        self._prepare_extension_files(extension_path)
-        
-        # Using chromium from playwright with extension
-        browser = playwright.chromium.launch_persistent_context(
-            user_data_dir="",  # Empty string creates a temporary profile
-            headless=DEFAULT_HEADLESS,
-            proxy: { server: PROXY_SERVER},
-            args=[
-                f'--disable-extensions-except={extension_path}',
-                f'--load-extension={extension_path}',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-web-security',
-                '--disable-features=IsolateOrigins,site-per-process'
-            ],
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        )
+            ]
+        }
         
-        # Browser process tracking not working reliably in this environment
-        # Just return the browser without attempting to track it
-        return browser
-        
-    def _prepare_extension_files(self, extension_path):
-        """Create the necessary files for the rektCaptcha extension"""
-        manifest_path = os.path.join(extension_path, "manifest.json")
-        background_path = os.path.join(extension_path, "background.js")
-        content_path = os.path.join(extension_path, "content.js")
-        
-        # Create manifest.json if it doesn't exist
-        if not os.path.exists(manifest_path):
-            manifest_content = {
-                "name": "rektCaptcha",
-                "version": "1.0",
-                "manifest_version": 3,
-                "description": "Helps solve reCAPTCHA challenges",
-                "permissions": ["activeTab", "scripting"],
-                "background": {
-                    "service_worker": "background.js"
-                },
-                "content_scripts": [
-                    {
-                        "matches": ["*://*/*"],
-                        "js": ["content.js"],
-                        "all_frames": True
-                    }
-                ]
-            }
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest_content, f, indent=2)
             
-            with open(manifest_path, 'w') as f:
-                json.dump(manifest_content, f, indent=2)
-                
-        # Create background.js if it doesn't exist
-        if not os.path.exists(background_path):
-            background_content = """
+    # Create background.js if it doesn't exist
+    if not os.path.exists(background_path):
+        background_content = """
 // Helper functions for solving reCAPTCHA
 console.log('rektCaptcha extension background script loaded');
 
@@ -432,12 +1145,12 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
   }
 });
 """
-            with open(background_path, 'w') as f:
-                f.write(background_content)
-                
-        # Create content.js if it doesn't exist
-        if not os.path.exists(content_path):
-            content_script = """
+        with open(background_path, 'w') as f:
+            f.write(background_content)
+            
+    # Create content.js if it doesn't exist
+    if not os.path.exists(content_path):
+        content_script = """
 // rektCaptcha content script
 console.log('rektCaptcha content script loaded');
 
@@ -456,433 +1169,2009 @@ function detectRecaptcha() {
   };
 }
 
-// Run detection
-detectRecaptcha();
-document.addEventListener('DOMContentLoaded', detectRecaptcha);
-"""
-            with open(content_path, 'w') as f:
-                f.write(content_script)
-    
-    def _inject_custom_script(self, page, sitekey):
-        page.evaluate("""(key) => {
-            document.body.innerHTML = '';
-            document.head.innerHTML = '';
+// Run detection
+detectRecaptcha();
+document.addEventListener('DOMContentLoaded', detectRecaptcha);
+"""
+        with open(content_path, 'w') as f:
+            f.write(content_script)
+
+def extension_storage_settings() -> Dict[str, Any]:
+    settings = dict(EXTENSION_STORAGE_DEFAULTS)
+    # Decided by whether the classifier actually loaded (init_classifier runs before
+    # the profile template is built): if it failed, the extension has to solve
+    if tile_classifier is not None:
+        # Tiles are selected server-side, the extension must not click them as well.
+        # Challenges without a server model are reloaded by the solver instead
+        settings['recaptcha_auto_solve'] = 0
+    return settings
+
+def apply_extension_settings(context):
+    # Wait for the extension service worker so its install has completed
+    if context.service_workers:
+        worker = context.service_workers[0]
+    else:
+        worker = context.wait_for_event('serviceworker', timeout=PAGE_LOAD_TIMEOUT)
+    worker.evaluate("(settings) => chrome.storage.local.set(settings)", extension_storage_settings())
+
+def browser_launch_options(display: Optional[str] = None, placement_marker: Optional[str] = None) -> Dict[str, Any]:
+    viewport_width, viewport_height = (int(value) for value in BROWSER_VIEWPORT.split('x'))
+    options = {
+        'headless': DEFAULT_HEADLESS,
+        'args': [
+            f'--disable-extensions-except={EXTENSION_PATH}',
+            f'--load-extension={EXTENSION_PATH}',
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            '--disable-dev-shm-usage',
+            '--disable-web-security',
+            '--disable-features=IsolateOrigins,site-per-process'
+        ],
+        'viewport': {'width': viewport_width, 'height': viewport_height},
+        'user_agent': BROWSER_USER_AGENT,
+    }
+    if USE_PROXY and PROXY_SERVER:
+        proxy = {'server': PROXY_SERVER}
+        if PROXY_USERNAME:
+            proxy['username'] = PROXY_USERNAME
+            proxy['password'] = PROXY_PASSWORD
+        options['proxy'] = proxy
+    if display:
+        options['env'] = {**os.environ, 'DISPLAY': display}
+    if placement_marker:
+        options['env'] = {**options.get('env', os.environ), CpuPlacement.ENV_MARKER: placement_marker}
+    return options
+
+# Warmed browser profile template
+class ProfileTemplate:
+    """Chromium profile with rektCaptcha already installed and configured.
+
+    The template is built once per process; every browser then starts from a
+    cheap copy of it instead of first-run initializing an empty profile. Each
+    process builds its own "<template_root>-<pid>" directory, so several
+    processes on one host (cluster nodes, benchmarks) never rebuild a template
+    another one is cloning from.
+    """
+    def __init__(self, template_root: str, clone_root: str):
+        self.template_root = template_root
+        self.template_dir = None
+        self.clone_root = clone_root
+        self.lock = Lock()
+        self.ready = False
+
+    def ensure(self, playwright):
+        if self.ready:
+            return
+
+        with self.lock:
+            if self.ready:
+                return
+
+            start_time = time.time()
+            self._remove_stale()
+            self.template_dir = f"{self.template_root}-{os.getpid()}"
+            log.info("Building browser profile template in %s", self.template_dir)
+            shutil.rmtree(self.template_dir, ignore_errors=True)
+            os.makedirs(self.template_dir, exist_ok=True)
+
+            context = playwright.chromium.launch_persistent_context(
+                user_data_dir=self.template_dir,
+                **browser_launch_options()
+            )
+            try:
+                apply_extension_settings(context)
+            finally:
+                context.close()
+
+            self.ready = True
+            elapsed_time = time.time() - start_time
+            metrics.record('profile_template_build', elapsed_time)
+            log.info("Profile template ready in %.2fs", elapsed_time)
+
+    def _remove_stale(self):
+        # Templates left behind by processes that are gone
+        parent, prefix = os.path.split(self.template_root)
+        try:
+            names = os.listdir(parent or '.')
+        except OSError:
+            return
+        for name in names:
+            pid = name[len(prefix) + 1:] if name.startswith(prefix + '-') else ''
+            if pid.isdigit() and not psutil.pid_exists(int(pid)):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+    def remove(self):
+        if self.template_dir:
+            shutil.rmtree(self.template_dir, ignore_errors=True)
+
+    def clone(self) -> str:
+        os.makedirs(self.clone_root, exist_ok=True)
+        profile_dir = tempfile.mkdtemp(prefix='recaptcha-profile-', dir=self.clone_root)
+
+        # Prefer a copy-on-write clone, fall back to a plain copy
+        proc = subprocess.run(
+            ['cp', '-a', '--reflink=auto', os.path.join(self.template_dir, '.'), profile_dir],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        ) if shutil.which('cp') else None
+        if proc is None or proc.returncode != 0:
+            shutil.copytree(self.template_dir, profile_dir, symlinks=True, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns('Singleton*'))
+
+        # Stale singleton locks would make Chromium refuse to open the copy
+        for name in ('SingletonLock', 'SingletonSocket', 'SingletonCookie'):
+            path = os.path.join(profile_dir, name)
+            if os.path.lexists(path):
+                os.remove(path)
+
+        return profile_dir
+
+profile_template = ProfileTemplate(PROFILE_TEMPLATE_DIR, PROFILE_CLONE_DIR)
+
+# Extension models
+def list_extension_models() -> List[str]:
+    models_path = os.path.join(EXTENSION_PATH, "models")
+    if not os.path.isdir(models_path):
+        return []
+    return sorted(name[:-len('.ort')] for name in os.listdir(models_path) if name.endswith('.ort'))
+
+# Server-side tile classification
+# Keywords in the challenge prompt for each label model, longest match first
+CHALLENGE_LABELS = [
+    ('fire_hydrant', ('fire hydrant', 'hydrant')),
+    ('traffic_light', ('traffic light',)),
+    ('motorcycle', ('motorcycle',)),
+    ('bicycle', ('bicycle',)),
+    ('crosswalk', ('crosswalk', 'crossing')),
+    ('bus', ('bus',)),
+    ('car', ('car', 'vehicle')),
+]
+
+def challenge_label(challenge_text: str) -> Optional[str]:
+    text = (challenge_text or '').lower()
+    for label, keywords in CHALLENGE_LABELS:
+        if any(keyword in text for keyword in keywords):
+            return label
+    return None
+
+class TileClassifier:
+    """Runs the extension's per-label .ort classifiers on CPU with onnxruntime"""
+    INPUT_SIZE = 224
+
+    def __init__(self, models_path: str, threads: int = 0):
+        self.models_path = models_path
+        self.threads = threads
+        self.lock = Lock()
+        self.sessions = {}
+        self.inference_seconds = 0.0
+        self.inference_tiles = 0
+        # The yolov5 models are detection helpers, not tile classifiers
+        self.labels = {name for name in list_extension_models() if 'yolov5' not in name}
+
+        # The extension normalizes its planar CHW tensor with mean[i % 3] / std[i % 3];
+        # reproduce that exactly so scores (and thresholds) match the in-browser solver
+        index = np.arange(3 * self.INPUT_SIZE * self.INPUT_SIZE) % 3
+        shape = (3, self.INPUT_SIZE, self.INPUT_SIZE)
+        self.mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)[index].reshape(shape)
+        self.std = np.array([0.229, 0.224, 0.225], dtype=np.float32)[index].reshape(shape)
+
+    def has_label(self, label: Optional[str]) -> bool:
+        return label in self.labels
+
+    def load_all(self):
+        for label in sorted(self.labels):
+            self._session(label)
+
+    def _session(self, label: str):
+        with self.lock:
+            session = self.sessions.get(label)
+            if session is None:
+                start_time = time.time()
+                options = ort.SessionOptions()
+                if self.threads:
+                    options.intra_op_num_threads = self.threads
+                session = ort.InferenceSession(
+                    os.path.join(self.models_path, f"{label}.ort"),
+                    sess_options=options,
+                    providers=['CPUExecutionProvider']
+                )
+                self.sessions[label] = session
+                metrics.record(f'classifier_load:{label}', time.time() - start_time)
+            return session
+
+    def preprocess(self, images):
+        """(N, 224, 224, 3) uint8 RGB tiles -> (N, 3, 224, 224) float32 model input"""
+        batch = images.transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        batch -= self.mean
+        batch /= self.std
+        return batch
+
+    def classify(self, label: str, batch):
+        """Probability that each tile in the batch contains the label"""
+        session = self._session(label)
+        model_input = session.get_inputs()[0]
+        start_time = time.time()
+
+        fixed_batch = model_input.shape[0]
+        if isinstance(fixed_batch, int):
+            # The bundled models are exported with a fixed batch dimension
+            logits = np.concatenate([
+                session.run(None, {model_input.name: batch[i:i + fixed_batch]})[0]
+                for i in range(0, len(batch), fixed_batch)
+            ])
+        else:
+            logits = session.run(None, {model_input.name: batch})[0]
+
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        scores = exp[:, 1] / exp.sum(axis=1)
+
+        elapsed_time = time.time() - start_time
+        self.inference_seconds += elapsed_time
+        self.inference_tiles += len(batch)
+        metrics.record('classifier_inference', elapsed_time)
+        metrics.incr('classified_tiles', len(batch))
+        return scores
+
+class ClassificationBatcher:
+    """Collects tile batches from concurrent solves and classifies them in micro-batches"""
+    def __init__(self, classifier: TileClassifier, batch_size=16, max_wait_ms=15):
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = Queue()
+        self.worker_thread = Thread(target=self._process_requests, daemon=True)
+        self.worker_thread.start()
+
+    def submit(self, label: str, batch) -> Future:
+        future = Future()
+        self.requests.put((label, batch, future))
+        return future
+
+    def _process_requests(self):
+        while True:
+            pending = [self.requests.get()]
+            tile_count = len(pending[0][1])
+            deadline = time.time() + self.max_wait
+
+            # Give other solves a moment to add their tiles to this batch
+            while tile_count < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except Empty:
+                    break
+                pending.append(item)
+                tile_count += len(item[1])
+
+            by_label: Dict[str, List] = {}
+            for item in pending:
+                by_label.setdefault(item[0], []).append(item)
+
+            for label, items in by_label.items():
+                try:
+                    batch = np.concatenate([tiles for _, tiles, _ in items])
+                    scores = np.concatenate([
+                        self.classifier.classify(label, batch[i:i + self.batch_size])
+                        for i in range(0, len(batch), self.batch_size)
+                    ])
+                    offset = 0
+                    for _, tiles, future in items:
+                        future.set_result(scores[offset:offset + len(tiles)])
+                        offset += len(tiles)
+                    metrics.incr('classifier_batches')
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+
+def resize_tiles(tiles, size: int):
+    """Bilinear resize of a (N, H, W, 3) tile stack in one vectorized pass"""
+    _, height, width, _ = tiles.shape
+
+    def axis(length):
+        coords = np.clip((np.arange(size, dtype=np.float32) + 0.5) * length / size - 0.5, 0, length - 1)
+        low = coords.astype(np.int32)
+        high = np.minimum(low + 1, length - 1)
+        return low, high, coords - low
+
+    y0, y1, wy = axis(height)
+    x0, x1, wx = axis(width)
+    wy = wy[None, :, None, None]
+    wx = wx[None, None, :, None]
+
+    rows_top = tiles[:, y0].astype(np.float32)
+    rows_bottom = tiles[:, y1].astype(np.float32)
+    top = rows_top[:, :, x0] * (1 - wx) + rows_top[:, :, x1] * wx
+    bottom = rows_bottom[:, :, x0] * (1 - wx) + rows_bottom[:, :, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+def decode_image(data: bytes):
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
+class TileGrid:
+    """Classifier input for a whole challenge, sliced from the single payload image.
+
+    The payload is a 3x3 or 4x4 grid in one picture; all tiles are cut out
+    with a reshape and normalized as one batch. Replacement tiles of dynamic
+    challenges are written into their slot of the same batch.
+    """
+    def __init__(self, payload: bytes, grid_size: int):
+        image = decode_image(payload)
+        tile_size = min(image.shape[0], image.shape[1]) // grid_size
+        side = tile_size * grid_size
+        tiles = (image[:side, :side]
+                 .reshape(grid_size, tile_size, grid_size, tile_size, 3)
+                 .transpose(0, 2, 1, 3, 4)
+                 .reshape(grid_size * grid_size, tile_size, tile_size, 3))
+
+        self.grid_size = grid_size
+        self.batch = tile_classifier.preprocess(resize_tiles(tiles, TileClassifier.INPUT_SIZE))
+
+    def patch(self, replacements: Dict[int, bytes]):
+        if not replacements:
+            return
+        indices = list(replacements)
+        tiles = np.stack([decode_image(replacements[idx]) for idx in indices])
+        self.batch[indices] = tile_classifier.preprocess(resize_tiles(tiles, TileClassifier.INPUT_SIZE))
+
+# Runs on the bframe body and returns the prompt text and tile count in the same
+# round trip. Without indices it also returns the grid payload image; with indices
+# the replacement tiles at those positions, after settleMs for them to fade in.
+# Images are fetched in-frame (same origin) and sent as base64.
+CAPTURE_TILES_SCRIPT = """async (root, {indices, settleMs}) => {
+    const toBase64 = async (src) => {
+        const bytes = new Uint8Array(await (await fetch(src)).arrayBuffer());
+        let binary = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        return btoa(binary);
+    };
+    const loaded = (img) => Promise.race([
+        img.decode().catch(() => null),
+        new Promise(resolve => setTimeout(resolve, 3000))
+    ]);
+
+    await new Promise(resolve => setTimeout(resolve, settleMs || 0));
+    const prompt = root.querySelector('.rc-imageselect-desc-no-canonical');
+    const desc = root.querySelector('.rc-imageselect-desc');
+    const instructions = root.querySelector('.rc-imageselect-instructions');
+    const text = (prompt && prompt.textContent) || (desc && desc.textContent)
+        || (instructions && instructions.innerText) || null;
+    const images = Array.from(root.querySelectorAll('table.rc-imageselect-table td img'));
+    if (indices === null) {
+        const payload = images.find(img => !img.classList.contains('rc-image-tile-11'));
+        if (payload) await loaded(payload);
+        return {text, count: images.length, payload: payload ? await toBase64(payload.src) : null};
+    }
+
+    const tiles = {};
+    for (const idx of indices) {
+        const img = images[idx];
+        if (img && img.classList.contains('rc-image-tile-11')) {
+            await loaded(img);
+            tiles[idx] = await toBase64(img.src);
+        }
+    }
+    return {text, count: images.length, tiles};
+}"""
+
+# Whether the bframe still shows an unsolved challenge. Same signals as the
+# extension: the verify button is disabled once the widget has been solved
+# (the hidden bframe keeps its challenge markup), and both prompt variants
+# live under .rc-imageselect-instructions.
+CHALLENGE_UP_JS = """((root) => {
+    const button = root.querySelector('#recaptcha-verify-button');
+    if (button && button.disabled) return false;
+    return root.querySelector('#rc-imageselect, .rc-imageselect-instructions') !== null;
+})"""
+
+# Clicks a set of tiles on the bframe body in one round trip, with the same mouse
+# event sequence the extension uses. With verify it then clicks the verify button
+# once visible, lets the result settle and reports whether a challenge is still up.
+CLICK_TILES_SCRIPT = """async (root, {indices, delayMs, verify, settleMs}) => {
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+    const cells = root.querySelectorAll('table.rc-imageselect-table td');
+    for (const idx of indices) {
+        const cell = cells[idx];
+        if (!cell) continue;
+        const target = cell.querySelector('img') || cell;
+        for (const type of ['mousedown', 'mouseup', 'click']) {
+            target.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+        }
+        await sleep(delayMs);
+    }
+    if (!verify) return {verified: false, challenge: true};
+
+    const button = root.querySelector('#recaptcha-verify-button');
+    for (let waited = 0; !(button && button.offsetParent) && waited < 2000; waited += 100) {
+        await sleep(100);
+    }
+    if (!(button && button.offsetParent)) throw new Error('Verify button not visible');
+    button.click();
+    await sleep(settleMs);
+    return {verified: true, challenge: """ + CHALLENGE_UP_JS + """(root)};
+}"""
+
+# Asks for a different challenge, like the extension does for labels it has no
+# model for, and reports whether a challenge is up once the new one has loaded
+RELOAD_CHALLENGE_SCRIPT = """async (root, settleMs) => {
+    const button = root.querySelector('#recaptcha-reload-button');
+    if (!button) throw new Error('Reload button not found');
+    button.click();
+    await new Promise(resolve => setTimeout(resolve, settleMs));
+    return """ + CHALLENGE_UP_JS + """(root);
+}"""
+
+# Scrolls to the checkbox and clicks it, after letting the widget settle
+CHECKBOX_CLICK_SCRIPT = """async (node, settleMs) => {
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+    await sleep(settleMs);
+    node.scrollIntoView({behavior: 'smooth', block: 'center', inline: 'center'});
+    await sleep(500);
+    node.click();
+}"""
+
+# Polls the page for the response token in-page, so waiting costs one round trip
+TOKEN_POLL_SCRIPT = """(timeoutMs) => new Promise((resolve) => {
+    const started = Date.now();
+    const check = () => {
+        const responseInput = document.querySelector('#g-recaptcha-response');
+        const response = responseInput && responseInput.value;
+        if (response || Date.now() - started >= timeoutMs) {
+            resolve(response || null);
+        } else {
+            setTimeout(check, 250);
+        }
+    };
+    check();
+})"""
+
+def select_tiles(scores, grid_size: int) -> List[int]:
+    """Pick tiles the same way the extension does for its classifier scores"""
+    ranked = sorted(range(len(scores)), key=lambda idx: scores[idx], reverse=True)
+    selected = [idx for idx in ranked if scores[idx] > 0.7]
+
+    if grid_size == 3 and len(scores) == 9 and len(selected) not in (3, 4):
+        # A 3x3 static grid always has three or four matches
+        selected = ranked[:3]
+        if scores[ranked[2]] - scores[ranked[3]] < 0.025:
+            selected = ranked[:4]
+    elif not selected and len(scores) in (3, 4):
+        # Replacement tiles: be a little less strict before giving up
+        selected = [idx for idx in ranked if scores[idx] > 0.6]
+
+    return sorted(selected)
+
+def perceptual_hashes(batch):
+    """64-bit difference hash of every tile in a (N, 3, H, W) batch"""
+    gray = batch.mean(axis=1)
+    height, width = gray.shape[1:]
+    # Average the tile down to 8 rows x 9 columns and compare horizontal neighbours
+    rows = np.linspace(0, height, 9)[:-1].astype(np.intp)
+    cols = np.linspace(0, width, 10)[:-1].astype(np.intp)
+    cells = np.add.reduceat(np.add.reduceat(gray, rows, axis=1), cols, axis=2)
+    bits = (cells[:, :, 1:] > cells[:, :, :-1]).reshape(len(batch), 64)
+    return np.packbits(bits, axis=1).view('>u8').ravel()
+
+class TileScoreCache:
+    """Bounded LRU cache of tile scores keyed by perceptual hash and label.
+
+    Entries live in one fixed-size record array, which can be backed by a
+    memory-mapped file so the cache survives restarts.
+    """
+    RECORD = [('hash', '<u8'), ('score', '<f4'), ('label', 'u1'), ('used', 'u1')]
+
+    def __init__(self, capacity: int, labels: List[str], path: str = ''):
+        self.capacity = capacity
+        self.label_ids = {label: idx for idx, label in enumerate(labels)}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            mode = 'r+' if os.path.exists(path) and os.path.getsize(path) == capacity * np.dtype(self.RECORD).itemsize else 'w+'
+            self.entries = np.memmap(path, dtype=self.RECORD, mode=mode, shape=(capacity,))
+        else:
+            self.entries = np.zeros(capacity, dtype=self.RECORD)
+
+        # (hash, label id) -> slot, least recently used first
+        self.slots = OrderedDict()
+        for slot in np.flatnonzero(self.entries['used']):
+            entry = self.entries[slot]
+            self.slots[(int(entry['hash']), int(entry['label']))] = int(slot)
+        self.free = [slot for slot in range(capacity - 1, -1, -1) if not self.entries['used'][slot]]
+
+    def get(self, tile_hash: int, label: str) -> Optional[float]:
+        key = (int(tile_hash), self.label_ids[label])
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.slots.move_to_end(key)
+            self.hits += 1
+            return float(self.entries['score'][slot])
+
+    def put(self, tile_hash: int, label: str, score: float):
+        key = (int(tile_hash), self.label_ids[label])
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                else:
+                    _, slot = self.slots.popitem(last=False)
+                self.entries[slot] = (key[0], score, key[1], 1)
+                self.slots[key] = slot
+            else:
+                self.entries['score'][slot] = score
+                self.slots.move_to_end(key)
+
+    def flush(self):
+        if isinstance(self.entries, np.memmap):
+            self.entries.flush()
+
+    def stats(self, seconds_per_tile: float = 0.0) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.slots),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0,
+                'cpuSavedSeconds': round(self.hits * seconds_per_tile, 2)
+            }
+
+def classify_tiles(label: str, batch):
+    """Scores for a tile batch, classifying only tiles not seen before"""
+    hashes = perceptual_hashes(batch)
+    scores = np.empty(len(batch), dtype=np.float32)
+    missing = []
+    for idx, tile_hash in enumerate(hashes):
+        cached = tile_cache.get(tile_hash, label)
+        if cached is None:
+            missing.append(idx)
+        else:
+            scores[idx] = cached
+
+    if missing:
+        # Classify the remaining tiles together with those of other running solves
+        scores[missing] = classification_batcher.submit(label, batch[missing]).result(timeout=30)
+        for idx in missing:
+            tile_cache.put(hashes[idx], label, scores[idx])
+
+    return scores
+
+def tile_cache_stats() -> Optional[Dict[str, Any]]:
+    if tile_cache is None:
+        return None
+    seconds_per_tile = 0.0
+    if tile_classifier.inference_tiles:
+        seconds_per_tile = tile_classifier.inference_seconds / tile_classifier.inference_tiles
+    return tile_cache.stats(seconds_per_tile)
+
+# Created by init_classifier when SERVER_CLASSIFICATION is on
+tile_classifier = None
+classification_batcher = None
+tile_cache = None
+
+# Playwright tracing
+class TraceRing:
+    """Playwright traces for failed, slow and sampled solves, in a size-capped directory.
+
+    Whether a solve is slow is only known at the end, so every solve is
+    recorded while tracing is on and the trace is discarded unless kept.
+    """
+    def __init__(self, directory: str, max_mb: int, sample_rate: float, slow_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def start(self, context) -> bool:
+        if not self.enabled:
+            return False
+        try:
+            context.tracing.start(screenshots=True, snapshots=True, sources=False)
+            return True
+        except Exception as e:
+            log.warning("Could not start tracing: %s", e)
+            return False
+
+    def finish(self, context, elapsed: float, failed: bool) -> Optional[str]:
+        """Stop tracing and return the saved trace's file name, or None if it was discarded"""
+        if failed:
+            reason = 'failed'
+        elif self.slow_seconds and elapsed >= self.slow_seconds:
+            reason = 'slow'
+        elif random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            context.tracing.stop()
+            return None
+        
+        task_id = get_log_context()['task_id'] or uuid.uuid4().hex
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{reason}-{task_id}.zip"
+        os.makedirs(self.directory, exist_ok=True)
+        context.tracing.stop(path=os.path.join(self.directory, name))
+        metrics.incr(f'traces_{reason}')
+        log.info("Saved %s trace %s (%.1fs)", reason, name, elapsed)
+        self.trim()
+        return name
+
+    def trim(self):
+        """Delete the oldest traces until the directory fits in its cap"""
+        with self.lock:
+            traces = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.zip'):
+                    stat = entry.stat()
+                    traces.append((stat.st_mtime, stat.st_size, entry.path))
+            traces.sort()
+            total = sum(size for _, size, _ in traces)
+            for _, size, path in traces:
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                metrics.incr('traces_evicted')
+
+trace_ring = TraceRing(TRACE_DIR, TRACE_DIR_MAX_MB, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS)
+
+# reCAPTCHA Solver class
+class RecaptchaSolver:
+    def __init__(self):
+        self.retry_count = RETRY_COUNT
+        self.retry_delay = RETRY_DELAY
+        # What the last solve ran into, reported with its result for the statistics index
+        self.challenged = False
+        self.retries = 0
+    
+    def solve(self, url: str, sitekey: str) -> Dict[str, Any]:
+        # Tasks are accepted before startup finishes; hold the solve until it has
+        services_ready.wait()
+        
+        if warm_pages:
+            warm_pages.record(url, sitekey)
+            warm_page = warm_pages.take(url, sitekey)
+            if warm_page:
+                set_log_stage('warm-page')
+                log.debug("Using pre-warmed page for %s", url)
+                return warm_page.solve()
+        
+        start_time = time.time()
+        tracing = False
+        reset_rpc_count()
+        display = display_manager.acquire() if display_manager else None
+        with sync_playwright() as playwright:
+            try:
+                set_log_stage('launch')
+                browser, profile_dir = self._init_browser(playwright, display)
+                tracing = trace_ring.start(browser)
+                page = self._open_ready_page(browser, url, sitekey)
+                
+                set_log_stage('checkbox')
+                log.debug("Handling reCAPTCHA...")
+                recaptcha_token = self._handle_recaptcha(page)
+                
+                result = {
+                    'success': 1,
+                    'message': "ready",
+                    'gRecaptchaResponse': recaptcha_token
+                }
+            except Exception as e:
+                log.warning("Error in solve: %s", e)
+                result = {
+                    'success': 0,
+                    'message': "failed",
+                    'error': str(e)
+                }
+            finally:
+                result.update(challenged=self.challenged, retries=self.retries, rpcs=rpc_count())
+                if 'browser' in locals():
+                    if tracing:
+                        result['trace'] = self._finish_trace(browser, time.time() - start_time, result['success'] != 1)
+                    self._close_browser(browser, profile_dir)
+                if display:
+                    display_manager.release(display)
+        return result
+    
+    def _finish_trace(self, browser, elapsed, failed):
+        try:
+            return trace_ring.finish(browser, elapsed, failed)
+        except Exception as e:
+            log.warning("Could not save trace: %s", e)
+            return None
+    
+    def _open_ready_page(self, browser, url, sitekey):
+        """Navigate and render the widget, up to the point where the checkbox can be clicked"""
+        page = browser.new_page()
+        page._sitekey = sitekey  # Store sitekey for later use
+        
+        set_log_stage('navigate')
+        log.debug("Navigating to %s", url)
+        page.goto(url, timeout=PAGE_LOAD_TIMEOUT)
+        log.debug("Page loaded")
+        
+        # Wait a bit after page load
+        page.wait_for_timeout(2000)
+        
+        log.debug("Injecting custom script...")
+        self._inject_custom_script(page, sitekey)
+        return page
+    
+    def _close_browser(self, browser, profile_dir):
+        browser.close()
+        if hasattr(browser, '_placement_group'):
+            cpu_placement.release(browser._placement_group)
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+    
+    def _init_browser(self, playwright, display=None):
+        start_time = time.time()
+        profile_dir = None
+        
+        if USE_PROFILE_TEMPLATE:
+            profile_template.ensure(playwright)
+            profile_dir = profile_template.clone()
+        
+        placement = cpu_placement.acquire() if cpu_placement else None
+        
+        # Using chromium from playwright with extension
+        try:
+            browser = playwright.chromium.launch_persistent_context(
+                user_data_dir=profile_dir or "",  # Empty string creates a temporary profile
+                **browser_launch_options(display, placement[1] if placement else None)
+            )
+        except Exception:
+            if placement:
+                cpu_placement.release(placement[0])
+            if profile_dir:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        
+        if placement:
+            # Released again in _close_browser
+            browser._placement_group = placement[0]
+            pinned = cpu_placement.apply(*placement)
+            log.debug("Pinned %s browser processes to cores %s", pinned, cpu_placement.groups[placement[0]])
+        
+        if not profile_dir and tile_classifier is not None:
+            apply_extension_settings(browser)
+        
+        elapsed_time = time.time() - start_time
+        metrics.record('browser_launch', elapsed_time)
+        log.debug("Browser launched in %.2fs", elapsed_time)
+        
+        # Browser process tracking not working reliably in this environment
+        # Just return the browser without attempting to track it
+        return browser, profile_dir
+        
+    def _inject_custom_script(self, page, sitekey):
+        page.evaluate("""(key) => {
+            document.body.innerHTML = '';
+            document.head.innerHTML = '';
+
+            const style = document.createElement('style');
+            style.textContent = `
+                body {
+                    display: flex;
+                    flex-direction: column;
+                    justify-content: center;
+                    align-items: center;
+                    min-height: 100vh;
+                    margin: 0;
+                    padding: 0;
+                    background-color: #000080;
+                }
+                .scale {
+                    transform: scale(1.2);
+                    transform-origin: center;
+                    margin: 20px;
+                    position: relative;
+                    z-index: 9999;
+                }
+                .g-recaptcha {
+                    position: relative !important;
+                    z-index: 9999 !important;
+                }
+                .g-recaptcha iframe {
+                    position: relative !important;
+                    z-index: 9999 !important;
+                }
+                textarea {
+                    width: 800px;
+                    height: 300px;
+                    margin-top: 20px;
+                    padding: 10px;
+                    border-radius: 5px;
+                    border: 1px solid #ccc;
+                    resize: vertical;
+                }
+            `;
+            document.head.appendChild(style);
+
+            const form = document.createElement('form');
+            form.method = 'POST';
+
+            const recaptchaDiv = document.createElement('div');
+            recaptchaDiv.className = 'g-recaptcha scale';
+            recaptchaDiv.dataset.sitekey = key;
+            recaptchaDiv.dataset.callback = 'submit';
+
+            const displayTextarea = document.createElement('textarea');
+            displayTextarea.id = 'g-recaptcha-response';
+            displayTextarea.name = 'g-recaptcha-response';
+            displayTextarea.placeholder = 'Token will appear here...';
+            displayTextarea.readOnly = true;
+
+            form.appendChild(recaptchaDiv);
+            form.appendChild(displayTextarea);
+            document.body.appendChild(form);
+
+            window.submit = function (token) {
+                displayTextarea.value = token;
+                return false;
+            };
+
+            const script = document.createElement('script');
+            script.src = 'https://www.google.com/recaptcha/api.js';
+            script.async = true;
+            script.defer = true;
+            document.head.appendChild(script);
+        }""", sitekey)
+        
+        # Wait for reCAPTCHA script to load
+        page.wait_for_function("""() => {
+            return typeof window.grecaptcha !== 'undefined' && window.grecaptcha.ready;
+        }""", timeout=30000)
+        
+        log.debug('reCAPTCHA iframe is visible')
+    
+    def _handle_recaptcha(self, page):
+        log.debug('Waiting for reCAPTCHA to be checked...')
+        attempt = 0
+        
+        while attempt < self.retry_count:
+            self.retries = attempt
+            try:
+                # Waits for the iframe as well; locators themselves cost no round trip
+                frame = page.frame_locator('iframe[title="reCAPTCHA"]')
+                checkbox = frame.locator('#recaptcha-anchor')
+                checkbox.wait_for(state='visible', timeout=20000)
+                log.debug('Checkbox is visible')
+                
+                # Try clicking a few times if necessary; the first try lets the widget settle
+                clicked = False
+                for i in range(3):
+                    try:
+                        checkbox.evaluate(CHECKBOX_CLICK_SCRIPT, 2000 if i == 0 else 1000)
+                        clicked = True
+                        log.debug('Clicked checkbox using JavaScript')
+                        break
+                    except Exception as e:
+                        log.debug("Click attempt %s failed: %s", i + 1, e)
+                
+                if not clicked:
+                    raise Exception('Failed to click checkbox after multiple attempts')
+                
+                # Now check if we got an image challenge
+                try:
+                    # Returns as soon as a challenge shows up, or gives up after 3s
+                    challenge_frame = page.frame_locator('iframe[title="recaptcha challenge expires in two minutes"]')
+                    try:
+                        challenge_frame.locator('#rc-imageselect, .rc-imageselect-instructions').first.wait_for(
+                            state='attached', timeout=3000)
+                        challenge_exists = True
+                    except PlaywrightTimeoutError:
+                        challenge_exists = False
+                    
+                    if challenge_exists:
+                        self.challenged = True
+                        set_log_stage('challenge')
+                        log.debug("Image challenge detected, attempting to solve...")
+                        challenge_start = time.time()
+                        self._solve_image_challenge(page, challenge_frame)
+                        # Covers the extension's in-frame model inference and the tile clicks
+                        metrics.record('image_challenge', time.time() - challenge_start)
+                except Exception as challenge_error:
+                    log.debug("No image challenge found or error: %s", challenge_error)
+                
+                # The token is written once the checkbox is verified, directly or after
+                # the image challenge, so waiting on it covers the verification too
+                set_log_stage('token')
+                token = page.evaluate(TOKEN_POLL_SCRIPT, 150000)
+                
+                if token:
+                    log.debug('Got reCAPTCHA response')
+                    return token
+                
+                raise Exception('No reCAPTCHA response found')
+                
+            except Exception as e:
+                attempt += 1
+                log.warning("reCAPTCHA attempt %s failed: %s", attempt, e)
+                
+                if attempt < self.retry_count:
+                    log.debug("Waiting %s seconds before retrying...", self.retry_delay / 1000)
+                    time.sleep(self.retry_delay / 1000)
+                    
+                    # Refresh the page and reinject
+                    page.reload(timeout=30000, wait_until="networkidle")
+                    page.wait_for_timeout(2000)
+                    self._inject_custom_script(page, page._sitekey)
+        
+        raise Exception('Failed to handle reCAPTCHA after maximum attempts')
+        
+    def _solve_image_challenge(self, page, challenge_frame):
+        """Attempt to solve the image challenge, one round at a time"""
+        try:
+            root = challenge_frame.locator('body')
+            anchor = page.frame_locator('iframe[title="reCAPTCHA"]').locator('#recaptcha-anchor')
+            for _ in range(CHALLENGE_MAX_ROUNDS):
+                if not self._solve_challenge_round(root):
+                    return
+                if anchor.get_attribute('aria-checked') == 'true':
+                    return
+                log.debug("Need to solve more challenges")
+            log.warning("Still challenged after %s rounds, waiting on the token", CHALLENGE_MAX_ROUNDS)
+                
+        except Exception as e:
+            log.warning("Error solving image challenge: %s", e)
+            # Continue anyway as the user might need to solve manually
+    
+    def _solve_challenge_round(self, root) -> bool:
+        """Solve the challenge on screen and report whether another one is up"""
+        # Prompt, tile count and (if we classify here) the payload image in one round trip
+        captured = root.evaluate(CAPTURE_TILES_SCRIPT, {'indices': None if tile_classifier else []})
+        challenge_text = captured['text'] or ''
+        log.debug("Challenge text: %s", challenge_text)
+        
+        # Determine what we're looking for
+        label = challenge_label(challenge_text)
+        log.debug("Looking for objects: %s", label)
+        
+        if not tile_classifier:
+            log.debug("No server-side classification, leaving the challenge to the extension")
+            return False
+        
+        if not tile_classifier.has_label(label):
+            # The extension's auto-solve is off while we classify, so nobody else
+            # would skip this one: get a challenge for a label we have a model for
+            log.debug("No server-side model for this challenge, reloading it")
+            metrics.incr('challenge_reloads')
+            return root.evaluate(RELOAD_CHALLENGE_SCRIPT, 2000)
+        
+        grid = self._grid_from_capture(captured)
+        log.debug("Found %s tiles", grid.grid_size ** 2)
+        
+        scores = classify_tiles(label, grid.batch)
+        selected_tiles = select_tiles(scores, grid.grid_size)
+        
+        # Dynamic challenges replace clicked tiles until none are left
+        dynamic = 'none left' in challenge_text.lower()
+        outcome = self._click_tiles(root, selected_tiles, scores, verify=not (dynamic and selected_tiles))
+        while not outcome['verified']:
+            replacements = self._capture_replacements(root, selected_tiles, settle_ms=2000)
+            grid.patch(replacements)
+            
+            indices = sorted(replacements)
+            replacement_scores = classify_tiles(label, grid.batch[indices]) if indices else []
+            selected_tiles = [indices[i] for i in select_tiles(replacement_scores, grid.grid_size)]
+            # Verify along with the last clicks once nothing new matches
+            outcome = self._click_tiles(root, selected_tiles, dict(zip(indices, replacement_scores)),
+                                        verify=not selected_tiles)
+        
+        return outcome['challenge']
+    
+    def _grid_from_capture(self, captured):
+        """Slice the payload returned by CAPTURE_TILES_SCRIPT into the classifier batch"""
+        if not captured['payload']:
+            raise Exception('Challenge payload image not found')
+        grid_size = 4 if captured['count'] == 16 else 3
+        return TileGrid(base64.b64decode(captured['payload']), grid_size)
+    
+    def _capture_replacements(self, root, indices, settle_ms=0):
+        captured = root.evaluate(CAPTURE_TILES_SCRIPT, {'indices': list(indices), 'settleMs': settle_ms})
+        return {int(idx): base64.b64decode(data) for idx, data in captured['tiles'].items()}
+    
+    def _click_tiles(self, root, selected_tiles, scores, verify=False):
+        """Click all selected tiles in one round trip, optionally followed by verify"""
+        for idx in selected_tiles:
+            log_sampled("Clicking tile %s (score %.2f)", idx, scores[idx])
+        if verify:
+            log.debug("Clicking verify button")
+        return root.evaluate(CLICK_TILES_SCRIPT, {
+            'indices': list(selected_tiles),
+            'delayMs': 300,  # Small delay between clicks
+            'verify': verify,
+            'settleMs': 5000  # Wait for the verify result
+        })
+
+# Pre-warmed pages for hot (url, sitekey) pairs
+class HotKeyTracker:
+    """Request counts per (url, sitekey), evicting the least recently requested pair"""
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = OrderedDict()
+
+    def record(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.counts.move_to_end(key)
+        while len(self.counts) > self.capacity:
+            self.counts.popitem(last=False)
+
+    def hottest(self, limit: int, min_count: int) -> List:
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [key for key, count in ranked[:limit] if count >= min_count]
+
+    def recency(self, key) -> int:
+        # Higher is more recent; pairs no longer tracked rank lowest
+        for rank, tracked in enumerate(reversed(self.counts)):
+            if tracked == key:
+                return len(self.counts) - rank
+        return -1
+
+class WarmPage:
+    """A browser with the widget rendered, waiting on its own thread for one task.
+
+    Playwright objects belong to the thread that created them, so the task is
+    handed to this thread and the result handed back through a Future.
+    """
+    def __init__(self, url: str, sitekey: str):
+        self.url = url
+        self.sitekey = sitekey
+        self.created = time.monotonic()
+        self.ready = Event()
+        self.failed = False
+        self.jobs = Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def expired(self, max_age: float) -> bool:
+        return time.monotonic() - self.created > max_age
+
+    def usable(self) -> bool:
+        return self.ready.is_set() and not self.failed and self.thread.is_alive()
+
+    def solve(self) -> Dict[str, Any]:
+        job = Future()
+        # Log lines from the page thread belong to the task that took the page
+        job.log_context = get_log_context()
+        self.jobs.put(job)
+        return job.result()
+
+    def discard(self):
+        self.jobs.put(None)
+
+    def _run(self):
+        services_ready.wait()
+        solver = RecaptchaSolver()
+        display = display_manager.acquire() if display_manager else None
+        start_time = time.time()
+        job = None
+        result = None
+        tracing = False
+        with sync_playwright() as playwright:
+            try:
+                browser, profile_dir = solver._init_browser(playwright, display)
+                page = solver._open_ready_page(browser, self.url, self.sitekey)
+                metrics.record('warm_page_prepare', time.time() - start_time)
+                self.ready.set()
+
+                job = self.jobs.get()
+                if job is not None:
+                    set_log_context(**job.log_context)
+                    set_log_stage('checkbox')
+                    # Only the task's part is traced, not the time the page sat idle
+                    tracing = trace_ring.start(browser)
+                    start_time = time.time()
+                    reset_rpc_count()
+                    log.debug("Handling reCAPTCHA on pre-warmed page...")
+                    result = {
+                        'success': 1,
+                        'message': "ready",
+                        'gRecaptchaResponse': solver._handle_recaptcha(page)
+                    }
+            except Exception as e:
+                self.failed = True
+                log.warning("Error on pre-warmed page for %s: %s", self.url, e)
+                if job is not None:
+                    result = {
+                        'success': 0,
+                        'message': "failed",
+                        'error': str(e)
+                    }
+            finally:
+                if result:
+                    result.update(challenged=solver.challenged, retries=solver.retries, rpcs=rpc_count())
+                if tracing and result:
+                    result['trace'] = solver._finish_trace(browser, time.time() - start_time, result['success'] != 1)
+                # Hand the result back before the browser is torn down
+                if job is not None and not job.done():
+                    job.set_result(result or {'success': 0, 'message': "failed", 'error': 'Pre-warmed page closed'})
+                if 'browser' in locals():
+                    solver._close_browser(browser, profile_dir)
+                if display:
+                    display_manager.release(display)
+
+class WarmPagePool:
+    """Keeps one ready page for each of the most requested (url, sitekey) pairs"""
+    def __init__(self, max_pages=2, min_requests=3, max_age=300, min_free_mb=1024):
+        self.max_pages = max_pages
+        self.min_requests = min_requests
+        self.max_age = max_age
+        self.min_free_bytes = min_free_mb * 1024 * 1024
+        self.tracker = HotKeyTracker()
+        self.pages: Dict[Any, WarmPage] = {}
+        self.lock = Lock()
+        self.stopped = False
+
+    def start(self):
+        Thread(target=self._maintain_pages, daemon=True).start()
+
+    def stop(self):
+        """Close idle pages and stop preparing new ones; pages already handed a task finish it"""
+        with self.lock:
+            self.stopped = True
+            for page in self.pages.values():
+                page.discard()
+            self.pages.clear()
+
+    def record(self, url: str, sitekey: str):
+        with self.lock:
+            self.tracker.record((url, sitekey))
+
+    def take(self, url: str, sitekey: str) -> Optional[WarmPage]:
+        with self.lock:
+            page = self.pages.get((url, sitekey))
+            if page and page.usable():
+                del self.pages[(url, sitekey)]
+                metrics.incr('warm_page_hits')
+                return page
+        metrics.incr('warm_page_misses')
+        return None
+
+    def _maintain_pages(self):
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                log.error("Error maintaining warm pages: %s", e)
+            time.sleep(1)
+
+    def refill(self):
+        with self.lock:
+            if self.stopped:
+                return
+            hot = self.tracker.hottest(self.max_pages, self.min_requests)
+
+            # Drop pages whose pair is no longer hot, that are too old to trust, or that died
+            for key, page in list(self.pages.items()):
+                if key not in hot or page.expired(self.max_age) or page.failed or not page.thread.is_alive():
+                    page.discard()
+                    del self.pages[key]
+
+            # Memory cap: give up the least recently requested page instead of adding one
+            if psutil.virtual_memory().available < self.min_free_bytes:
+                if self.pages:
+                    key = min(self.pages, key=self.tracker.recency)
+                    self.pages.pop(key).discard()
+                    metrics.incr('warm_page_memory_evictions')
+                return
+
+            for key in hot:
+                if key not in self.pages:
+                    self.pages[key] = WarmPage(*key)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                {'url': url, 'sitekey': sitekey, 'ready': page.usable(), 'requests': self.tracker.counts.get((url, sitekey), 0)}
+                for (url, sitekey), page in self.pages.items()
+            ]
+
+# Created by create_app when WARM_PAGES_MAX > 0
+warm_pages = None
+
+# Stub solver backend
+class StubSolver:
+    """Drop-in for RecaptchaSolver that sleeps instead of launching Chromium.
+
+    Latency is log-normal around STUB_LATENCY_MEDIAN and a STUB_FAILURE_RATE
+    fraction of solves fail, so the HTTP, queue and task store layers can be
+    load-tested on their own.
+    """
+    def __init__(self, median=STUB_LATENCY_MEDIAN, sigma=STUB_LATENCY_SIGMA, failure_rate=STUB_FAILURE_RATE):
+        self.median = median
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+
+    def solve(self, url: str, sitekey: str) -> Dict[str, Any]:
+        latency = random.lognormvariate(math.log(self.median), self.sigma) if self.median > 0 else 0
+        time.sleep(latency)
+
+        if random.random() < self.failure_rate:
+            return {
+                'success': 0,
+                'message': "failed",
+                'error': 'Stub solver failure'
+            }
+        return {
+            'success': 1,
+            'message': "ready",
+            'gRecaptchaResponse': '03AStub' + uuid.uuid4().hex * 15
+        }
+
+def make_solver():
+    return StubSolver() if SOLVER_BACKEND == 'stub' else RecaptchaSolver()
+
+# Cluster mode
+class ClusterBackend:
+    """Task queue and result store shared by all nodes of a cluster"""
+    def enqueue(self, task_id: str, payload: Dict[str, Any]):
+        raise NotImplementedError
+
+    def claim(self, node_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Take the oldest pending task and record it as in flight on this node"""
+        raise NotImplementedError
+
+    def complete(self, node_id: str, task_id: str):
+        raise NotImplementedError
+
+    def save_task(self, task_id: str, fields: Dict[str, Any], ttl: int):
+        """Merge fields into the task's record and (re)set its expiry"""
+        raise NotImplementedError
+
+    def load_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_task(self, task_id: str):
+        raise NotImplementedError
+
+    def claim_key(self, key: str, value: str, ttl: int) -> Optional[str]:
+        """Set key to value unless it is already set; returns the existing value"""
+        raise NotImplementedError
+
+    def set_key(self, key: str, value: str, ttl: int):
+        raise NotImplementedError
+
+    def heartbeat(self, node_id: str, ttl: int):
+        raise NotImplementedError
+
+    def reclaim_dead_nodes(self) -> int:
+        """Put tasks in flight on nodes without a live heartbeat back in the queue"""
+        raise NotImplementedError
+
+    def requeue(self, node_id: str, task_id: str) -> bool:
+        """Put one task claimed by this node back at the front of the queue"""
+        raise NotImplementedError
+
+    def release(self, node_id: str) -> int:
+        """Put this node's in-flight tasks back in the queue and drop it from the cluster"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+class LocalClusterBackend(ClusterBackend):
+    """In-process stand-in for a shared backend, for tests and single-node runs"""
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = deque()
+        self.inflight: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.tasks: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.keys: Dict[str, Tuple[float, str]] = {}
+        self.heartbeats: Dict[str, float] = {}
+
+    def enqueue(self, task_id, payload):
+        with self.lock:
+            self.pending.append((task_id, payload))
+
+    def claim(self, node_id):
+        with self.lock:
+            if not self.pending:
+                return None
+            task_id, payload = self.pending.popleft()
+            self.inflight.setdefault(node_id, {})[task_id] = payload
+            return task_id, payload
+
+    def complete(self, node_id, task_id):
+        with self.lock:
+            self.inflight.get(node_id, {}).pop(task_id, None)
+
+    def save_task(self, task_id, fields, ttl):
+        with self.lock:
+            _, record = self.tasks.get(task_id, (0, {}))
+            record.update(fields)
+            self.tasks[task_id] = (time.time() + ttl, record)
+
+    def load_task(self, task_id):
+        with self.lock:
+            expires, record = self.tasks.get(task_id, (0, None))
+            if record is None or expires < time.time():
+                self.tasks.pop(task_id, None)
+                return None
+            return dict(record)
+
+    def delete_task(self, task_id):
+        with self.lock:
+            self.tasks.pop(task_id, None)
+
+    def claim_key(self, key, value, ttl):
+        with self.lock:
+            existing = self.keys.get(key)
+            if existing is not None and existing[0] >= time.time():
+                return existing[1]
+            self.keys[key] = (time.time() + ttl, value)
+            return None
+
+    def set_key(self, key, value, ttl):
+        with self.lock:
+            self.keys[key] = (time.time() + ttl, value)
+
+    def heartbeat(self, node_id, ttl):
+        with self.lock:
+            self.heartbeats[node_id] = time.time() + ttl
+
+    def reclaim_dead_nodes(self):
+        reclaimed = 0
+        with self.lock:
+            now = time.time()
+            dead = [node_id for node_id, expires in self.heartbeats.items() if expires < now]
+        for node_id in dead:
+            reclaimed += self.release(node_id)
+        return reclaimed
+
+    def requeue(self, node_id, task_id):
+        with self.lock:
+            payload = self.inflight.get(node_id, {}).pop(task_id, None)
+            if payload is None:
+                return False
+            self.pending.appendleft((task_id, payload))
+            return True
+
+    def release(self, node_id):
+        with self.lock:
+            # Released tasks go to the front in their claim order, they have waited longest
+            tasks = list(self.inflight.pop(node_id, {}).items())
+            self.pending.extendleft(reversed(tasks))
+            self.heartbeats.pop(node_id, None)
+        return len(tasks)
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            return {
+                'pending': len(self.pending),
+                'inflight': sum(len(tasks) for tasks in self.inflight.values()),
+                'nodes': sorted(node_id for node_id, expires in self.heartbeats.items() if expires >= now)
+            }
+
+class RedisClusterBackend(ClusterBackend):
+    """Shared backend on any Redis-protocol server (Redis, Valkey, KeyDB, ...)
+
+    The queue is a list; claiming moves an entry atomically into the node's
+    in-flight list, so a task is never lost or handed out twice, and the
+    in-flight list of a dead node can be moved back in one step per entry.
+    """
+    def __init__(self, url: str, prefix: str = 'recaptcha'):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.claimed: Dict[str, str] = {}
+
+    def _key(self, *parts) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    def enqueue(self, task_id, payload):
+        self.redis.lpush(self._key('queue'), json.dumps({'taskId': task_id, **payload}))
+
+    def claim(self, node_id):
+        entry = self.redis.lmove(self._key('queue'), self._key('inflight', node_id), 'RIGHT', 'LEFT')
+        if entry is None:
+            return None
+        payload = json.loads(entry)
+        task_id = payload.pop('taskId')
+        self.claimed[task_id] = entry
+        return task_id, payload
+
+    def complete(self, node_id, task_id):
+        entry = self.claimed.pop(task_id, None)
+        if entry is not None:
+            self.redis.lrem(self._key('inflight', node_id), 1, entry)
+
+    def save_task(self, task_id, fields, ttl):
+        key = self._key('task', task_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={name: value for name, value in fields.items() if value is not None})
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def load_task(self, task_id):
+        record = self.redis.hgetall(self._key('task', task_id))
+        if not record:
+            return None
+        for name in ('created', 'solve_time'):
+            if name in record:
+                record[name] = float(record[name])
+        return record
+
+    def delete_task(self, task_id):
+        self.redis.delete(self._key('task', task_id))
+
+    def claim_key(self, key, value, ttl):
+        # SET NX is atomic, so concurrent duplicates on different nodes still get one task
+        if self.redis.set(self._key('key', key), value, nx=True, ex=ttl):
+            return None
+        return self.redis.get(self._key('key', key))
+
+    def set_key(self, key, value, ttl):
+        self.redis.set(self._key('key', key), value, ex=ttl)
+
+    def heartbeat(self, node_id, ttl):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key('node', node_id), time.time(), px=ttl * 1000)
+        pipe.sadd(self._key('nodes'), node_id)
+        pipe.execute()
+
+    def reclaim_dead_nodes(self):
+        reclaimed = 0
+        for node_id in self.redis.smembers(self._key('nodes')):
+            if not self.redis.exists(self._key('node', node_id)):
+                reclaimed += self.release(node_id)
+        return reclaimed
+
+    def requeue(self, node_id, task_id):
+        entry = self.claimed.pop(task_id, None)
+        if entry is None:
+            return False
+        # Claims take from the right, so pushing there makes it the next task out
+        pipe = self.redis.pipeline()
+        pipe.lrem(self._key('inflight', node_id), 1, entry)
+        pipe.rpush(self._key('queue'), entry)
+        pipe.execute()
+        return True
+
+    def release(self, node_id):
+        released = 0
+        # Push back on the claiming end so released tasks are taken next. Claims push
+        # onto the left of the in-flight list, so the newest goes back first and the
+        # oldest ends up next in line
+        while self.redis.lmove(self._key('inflight', node_id), self._key('queue'), 'LEFT', 'RIGHT'):
+            released += 1
+        self.redis.delete(self._key('node', node_id))
+        self.redis.srem(self._key('nodes'), node_id)
+        return released
+
+    def stats(self):
+        nodes = sorted(node_id for node_id in self.redis.smembers(self._key('nodes'))
+                       if self.redis.exists(self._key('node', node_id)))
+        return {
+            'pending': self.redis.llen(self._key('queue')),
+            'inflight': sum(self.redis.llen(self._key('inflight', node_id)) for node_id in nodes),
+            'nodes': nodes
+        }
+
+class ClusterTaskStore:
+    """TaskStore interface over the cluster's shared result store"""
+    def __init__(self, backend: ClusterBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.evicted = 0
+
+    def __len__(self):
+        # Tasks live in the shared backend; see the cluster section of /health
+        return 0
+
+    def add(self, task_id: str, client_key: Optional[str]) -> TaskRecord:
+        record = TaskRecord(client_key)
+        self.backend.save_task(task_id, {'status': record.status, 'created': time.time(), 'client_key': client_key}, self.ttl)
+        return record
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        fields = self.backend.load_task(task_id)
+        if fields is None:
+            return None
+        record = TaskRecord(fields.get('client_key'))
+        # Wall-clock creation time from whichever node created it, as a local monotonic time
+        record.created = time.monotonic() - (time.time() - fields.get('created', time.time()))
+        record.status = fields.get('status', 'processing')
+        record.token = fields.get('token')
+        record.error = fields.get('error')
+        record.solve_time = fields.get('solve_time')
+        record.trace = fields.get('trace')
+        return record
+
+    def update(self, task_id: str, status: str, **fields):
+        self.backend.save_task(task_id, {'status': status, **fields}, self.ttl)
+
+    def pop(self, task_id: str):
+        self.backend.delete_task(task_id)
+
+    def is_expired(self, record: TaskRecord) -> bool:
+        # The backend expires tasks itself
+        return False
+
+    def expire(self, max_steps: int = 10000) -> int:
+        return 0
+
+    def values(self):
+        return []
+
+class ClusterIdempotencyIndex:
+    """IdempotencyIndex interface over the cluster backend, so retries may land on any node"""
+    def __init__(self, backend: ClusterBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+
+    def __len__(self):
+        return 0
+
+    def claim(self, key: Tuple[str, str], task_id: str, fingerprint: str, is_live) -> Optional[Tuple[str, str]]:
+        name = ':'.join(key)
+        # Stored as "<task ID>:<fingerprint>"; task IDs are UUIDs, so the last colon splits them
+        value = f"{task_id}:{fingerprint}"
+        existing = self.backend.claim_key(name, value, self.ttl)
+        if existing is None:
+            return None
+        existing_task, _, existing_fingerprint = existing.rpartition(':')
+        if is_live(existing_task):
+            return existing_task, existing_fingerprint
+        # The task behind the key is gone; this request takes the key over
+        self.backend.set_key(name, value, self.ttl)
+        return None
+
+    def expire(self, max_steps: int = 10000) -> int:
+        # The backend expires keys itself
+        return 0
 
-            const style = document.createElement('style');
-            style.textContent = `
-                body {
-                    display: flex;
-                    flex-direction: column;
-                    justify-content: center;
-                    align-items: center;
-                    min-height: 100vh;
-                    margin: 0;
-                    padding: 0;
-                    background-color: #000080;
-                }
-                .scale {
-                    transform: scale(1.2);
-                    transform-origin: center;
-                    margin: 20px;
-                    position: relative;
-                    z-index: 9999;
-                }
-                .g-recaptcha {
-                    position: relative !important;
-                    z-index: 9999 !important;
-                }
-                .g-recaptcha iframe {
-                    position: relative !important;
-                    z-index: 9999 !important;
-                }
-                textarea {
-                    width: 800px;
-                    height: 300px;
-                    margin-top: 20px;
-                    padding: 10px;
-                    border-radius: 5px;
-                    border: 1px solid #ccc;
-                    resize: vertical;
-                }
-            `;
-            document.head.appendChild(style);
+class ClusterNode:
+    """Heartbeats for this node, pulls shared tasks while it has free capacity and reclaims dead nodes' tasks"""
+    def __init__(self, backend: ClusterBackend, node_id: str, heartbeat_ttl: int):
+        self.backend = backend
+        self.node_id = node_id
+        self.heartbeat_ttl = heartbeat_ttl
+        self.stopped = Event()
+        self.threads: List[Thread] = []
 
-            const form = document.createElement('form');
-            form.method = 'POST';
+    def start(self):
+        # A previous process with this NODE_ID may have crashed within the heartbeat
+        # TTL: its heartbeat still looks alive, so nobody else would reclaim its tasks
+        released = self.backend.release(self.node_id)
+        if released:
+            log.warning("Re-queued %s tasks left in flight by a previous run of node %s", released, self.node_id)
+        self.backend.heartbeat(self.node_id, self.heartbeat_ttl)
+        request_queue.on_task_done = self.complete
+        self.threads = [Thread(target=self._heartbeat_loop, daemon=True),
+                        Thread(target=self._claim_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
 
-            const recaptchaDiv = document.createElement('div');
-            recaptchaDiv.className = 'g-recaptcha scale';
-            recaptchaDiv.dataset.sitekey = key;
-            recaptchaDiv.dataset.callback = 'submit';
+    def stop(self):
+        """Stop heartbeating and claiming; tasks already claimed keep running"""
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
 
-            const displayTextarea = document.createElement('textarea');
-            displayTextarea.id = 'g-recaptcha-response';
-            displayTextarea.name = 'g-recaptcha-response';
-            displayTextarea.placeholder = 'Token will appear here...';
-            displayTextarea.readOnly = true;
+    def submit(self, task_id: str, url: str, sitekey: str):
+        self.backend.enqueue(task_id, {'url': url, 'sitekey': sitekey})
 
-            form.appendChild(recaptchaDiv);
-            form.appendChild(displayTextarea);
-            document.body.appendChild(form);
+    def complete(self, task_id: str):
+        self.backend.complete(self.node_id, task_id)
 
-            window.submit = function (token) {
-                displayTextarea.value = token;
-                return false;
-            };
+    def _heartbeat_loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.backend.heartbeat(self.node_id, self.heartbeat_ttl)
+                reclaimed = self.backend.reclaim_dead_nodes()
+                if reclaimed:
+                    log.warning("Reclaimed %s tasks from dead nodes", reclaimed)
+                    metrics.incr('cluster_reclaimed_tasks', reclaimed)
+            except Exception as e:
+                log.error("Cluster heartbeat failed: %s", e)
+            self.stopped.wait(self.heartbeat_ttl / 3)
 
-            const script = document.createElement('script');
-            script.src = 'https://www.google.com/recaptcha/api.js';
-            script.async = true;
-            script.defer = true;
-            document.head.appendChild(script);
-        }""", sitekey)
-        
-        # Wait for reCAPTCHA script to load
-        page.wait_for_function("""() => {
-            return typeof window.grecaptcha !== 'undefined' && window.grecaptcha.ready;
-        }""", timeout=30000)
-        
-        print('reCAPTCHA iframe is visible')
-    
-    def _handle_recaptcha(self, page):
-        print('Waiting for reCAPTCHA to be checked...')
-        attempt = 0
-        
-        while attempt < self.retry_count:
+    def _claim_loop(self):
+        # Pull-based: whichever node has a free slot takes the next task
+        while not self.stopped.is_set():
             try:
-                # Wait for iframe to appear
-                page.wait_for_selector('iframe[title="reCAPTCHA"]', 
-                                      timeout=20000, 
-                                      state='attached')
-                
-                frame = page.frame_locator('iframe[title="reCAPTCHA"]')
-                print('iframe reCAPTCHA Found')
-                
-                # Wait and ensure checkbox is visible
-                checkbox = frame.locator('#recaptcha-anchor')
-                checkbox.wait_for(state='visible', timeout=20000)
-                print('Checkbox is visible')
-                
-                # Wait a bit to ensure checkbox is ready for interaction
-                page.wait_for_timeout(2000)
-                
-                # Try clicking a few times if necessary
-                clicked = False
-                for i in range(3):
-                    try:
-                        checkbox.evaluate("""node => {
-                            // Scroll to element
-                            node.scrollIntoView({
-                                behavior: 'smooth',
-                                block: 'center',
-                                inline: 'center'
-                            });
-                        }""")
-                        
-                        page.wait_for_timeout(500)
-                        
-                        # Try clicking with JavaScript
-                        checkbox.evaluate("node => node.click()")
-                        clicked = True
-                        print('Clicked checkbox using JavaScript')
-                        break
-                    except Exception as e:
-                        print(f"Click attempt {i + 1} failed: {str(e)}")
-                        page.wait_for_timeout(1000)
-                
-                if not clicked:
-                    raise Exception('Failed to click checkbox after multiple attempts')
-                
-                # Now check if we got an image challenge
-                try:
-                    # Wait a bit for image challenge to appear (if it does)
-                    page.wait_for_timeout(3000)
-                    
-                    # Check for image challenge frame
-                    challenge_frame = page.frame_locator('iframe[title="recaptcha challenge expires in two minutes"]')
-                    challenge_exists = challenge_frame.locator('div.rc-imageselect-desc').count() > 0
-                    
-                    if challenge_exists:
-                        print("Image challenge detected, attempting to solve...")
-                        self._solve_image_challenge(page, challenge_frame)
-                except Exception as challenge_error:
-                    print(f"No image challenge found or error: {str(challenge_error)}")
-                
-                # Wait for verification (either direct or after image challenge)
-                try:
-                    frame.locator('#recaptcha-anchor[aria-checked="true"]').wait_for(timeout=120000)
-                    print('reCAPTCHA successfully checked!')
-                except Exception as verify_error:
-                    print(f"Failed to verify checkbox is checked: {str(verify_error)}")
-                    # Continue anyway as we might still get a token
-                
-                # Wait for token with polling
-                token = page.evaluate("""() => {
-                    return new Promise((resolve) => {
-                        let attempts = 0;
-                        const maxAttempts = 30;
-                        const checkInterval = setInterval(() => {
-                            attempts++;
-                            const responseInput = document.querySelector('#g-recaptcha-response');
-                            const response = responseInput && responseInput.value;
-                            console.log(`Token check attempt ${attempts}: ${response ? 'found' : 'not found'}`);
-
-                            if (response) {
-                                clearInterval(checkInterval);
-                                resolve(response);
-                            }
-
-                            if (attempts >= maxAttempts) {
-                                clearInterval(checkInterval);
-                                resolve(null);
-                            }
-                        }, 1000);
-                    });
-                }""")
-                
-                if token:
-                    print('Got reCAPTCHA response')
-                    return token
-                
-                raise Exception('No reCAPTCHA response found')
-                
+                if not draining.is_set() and request_queue.has_capacity():
+                    claimed = self.backend.claim(self.node_id)
+                    if claimed:
+                        task_id, payload = claimed
+                        metrics.incr('cluster_claimed_tasks')
+                        request_queue.add(task_id, make_solver().solve, payload['url'], payload['sitekey'])
+                        continue
             except Exception as e:
-                attempt += 1
-                print(f"reCAPTCHA attempt {attempt} failed: {str(e)}")
-                
-                if attempt < self.retry_count:
-                    print(f"Waiting {self.retry_delay / 1000} seconds before retrying...")
-                    time.sleep(self.retry_delay / 1000)
-                    
-                    # Refresh the page and reinject
-                    page.reload(timeout=30000, wait_until="networkidle")
-                    page.wait_for_timeout(2000)
-                    self._inject_custom_script(page, page._sitekey)
+                log.error("Cluster claim failed: %s", e)
+            self.stopped.wait(0.2)
+
+    def requeue(self, task_ids: List[str]) -> int:
+        return sum(self.backend.requeue(self.node_id, task_id) for task_id in task_ids)
+
+    def release(self) -> int:
+        return self.backend.release(self.node_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'nodeId': self.node_id, **self.backend.stats()}
+
+def create_cluster_backend() -> ClusterBackend:
+    if CLUSTER_BACKEND == 'redis':
+        return RedisClusterBackend(REDIS_URL, CLUSTER_PREFIX)
+    if CLUSTER_BACKEND == 'local':
+        return LocalClusterBackend()
+    raise ValueError(f"Unknown CLUSTER_BACKEND: {CLUSTER_BACKEND}")
+
+# Created by create_app when CLUSTER_BACKEND is set
+cluster_node = None
+
+def submit_task(task_id: str, url: str, sitekey: str):
+    if cluster_node:
+        cluster_node.submit(task_id, url, sitekey)
+    else:
+        request_queue.add(task_id, make_solver().solve, url, sitekey)
+
+# Graceful drain
+draining = Event()
+# Summary of the previous process's shutdown, restored from the queue state file
+last_shutdown = None
+
+def save_queue_state(queued: List[tuple], unfinished: Dict[str, Tuple[float, tuple]], lost_seconds: float) -> int:
+    """Write queued and unfinished tasks plus unfetched results for the next process"""
+    now = time.time()
+    tasks = []
+    for task_id, args in [(item[0], item[2]) for item in queued] + [(task_id, args) for task_id, (_, args) in unfinished.items()]:
+        record = task_store.get(task_id)
+        if record is None:
+            continue
+        url, sitekey = args
+        tasks.append({'taskId': task_id, 'url': url, 'sitekey': sitekey,
+                      'clientKey': record.client_key, 'created': now - record.elapsed})
+    
+    pending_ids = {task['taskId'] for task in tasks}
+    results = []
+    with task_store.lock:
+        for task_id, record in task_store.tasks.items():
+            # Results a client has already fetched or can no longer fetch are not worth the write
+            if task_id in pending_ids or record.status == 'processing' or record.fetched or task_store.is_expired(record):
+                continue
+            results.append({'taskId': task_id, 'status': record.status, 'clientKey': record.client_key,
+                            'created': now - record.elapsed, 'token': record.token,
+                            'error': record.error, 'solve_time': record.solve_time})
+    
+    state = {'savedAt': now, 'lostSolverSeconds': round(lost_seconds, 2), 'tasks': tasks, 'results': results}
+    with open(QUEUE_STATE_PATH + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(QUEUE_STATE_PATH + '.tmp', QUEUE_STATE_PATH)
+    return len(tasks)
+
+def restore_queue_state():
+    """Re-queue tasks saved by the previous process during its drain"""
+    global last_shutdown
+    try:
+        with open(QUEUE_STATE_PATH) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning("Ignoring unreadable queue state %s: %s", QUEUE_STATE_PATH, e)
+        return
+    
+    now_wall, now = time.time(), time.monotonic()
+    for saved in state.get('results', []):
+        record = task_store.add(saved['taskId'], saved.get('clientKey'))
+        record.created = now - (now_wall - saved['created'])
+        task_store.update(saved['taskId'], saved['status'], token=saved.get('token'),
+                          error=saved.get('error'), solve_time=saved.get('solve_time'))
+    for saved in state.get('tasks', []):
+        record = task_store.add(saved['taskId'], saved.get('clientKey'))
+        record.created = now - (now_wall - saved['created'])
+        submit_task(saved['taskId'], saved['url'], saved['sitekey'])
+    os.remove(QUEUE_STATE_PATH)
+    
+    last_shutdown = {
+        'savedAt': datetime.fromtimestamp(state.get('savedAt', now_wall)).isoformat(),
+        'restoredTasks': len(state.get('tasks', [])),
+        'restoredResults': len(state.get('results', [])),
+        'lostSolverMinutes': round(state.get('lostSolverSeconds', 0) / 60, 2)
+    }
+    log.info("Restored %s queued tasks and %s results from the previous process (%s solver-minutes lost at its shutdown)",
+             last_shutdown['restoredTasks'], last_shutdown['restoredResults'], last_shutdown['lostSolverMinutes'])
+
+def drain_and_exit(timeout: float):
+    start = time.monotonic()
+    try:
+        if warm_pages:
+            warm_pages.stop()
+        # Queued tasks and unfetched results are handed over before the wait, so they
+        # survive even if the process is killed before the drain deadline
+        queued = request_queue.pause()
+        if cluster_node:
+            cluster_node.requeue([item[0] for item in queued])
+        else:
+            save_queue_state(queued, {}, 0)
+        log.info("Draining: %s queued tasks handed over, waiting up to %ss for %s running",
+                 len(queued), timeout, len(request_queue.running))
         
-        raise Exception('Failed to handle reCAPTCHA after maximum attempts')
+        unfinished = request_queue.wait_running(timeout)
+        now = time.monotonic()
+        # Solver time spent on tasks that must now start over
+        lost_seconds = sum(now - started for started, _ in unfinished.values())
         
-    def _solve_image_challenge(self, page, challenge_frame):
-        """Attempt to solve the image challenge"""
-        try:
-            # First, identify what we're looking for
-            challenge_text = challenge_frame.locator('.rc-imageselect-desc-no-canonical').text_content()
-            if not challenge_text:
-                challenge_text = challenge_frame.locator('.rc-imageselect-desc').text_content()
-                
-            print(f"Challenge text: {challenge_text}")
-            
-            # Determine what we're looking for
-            target_objects = []
-            if "bus" in challenge_text.lower():
-                target_objects.append("bus")
-            elif "car" in challenge_text.lower():
-                target_objects.append("car")
-            elif "fire hydrant" in challenge_text.lower():
-                target_objects.append("fire hydrant")
-            elif "bicycle" in challenge_text.lower():
-                target_objects.append("bicycle")
-            elif "traffic light" in challenge_text.lower():
-                target_objects.append("traffic light")
-            elif "crosswalk" in challenge_text.lower() or "crossing" in challenge_text.lower():
-                target_objects.append("crosswalk")
-            
-            print(f"Looking for objects: {target_objects}")
-            
-            # Get all image tiles
-            tiles = challenge_frame.locator('table.rc-imageselect-table td')
-            
-            # Wait a bit to make sure images are loaded
-            page.wait_for_timeout(2000)
-            
-            # Simplified image selection logic - in a real-world scenario,
-            # you would use image recognition or a more sophisticated approach
-            # For this example, I'll select tiles that are likely to contain the target
-            
-            # Get tile count
-            tile_count = tiles.count()
-            print(f"Found {tile_count} tiles")
-            
-            if "bus" in target_objects:
-                # For bus detection, let's select tiles that might contain buses
-                # In a real implementation, this would use image recognition
-                # For this demo, we'll select a pattern of tiles that might work
-                selected_tiles = [0, 2, 3, 8]  # Example pattern for buses
-                
-                for idx in selected_tiles:
-                    if idx < tile_count:
-                        print(f"Clicking tile {idx}")
-                        tiles.nth(idx).click()
-                        page.wait_for_timeout(300)  # Small delay between clicks
-            
-            # Wait for verification button to become enabled
-            verify_button = challenge_frame.locator('#recaptcha-verify-button')
-            verify_button.wait_for(state='enabled', timeout=2000)
-            
-            # Click verify
-            print("Clicking verify button")
-            verify_button.click()
-            
-            # Wait for result
-            page.wait_for_timeout(5000)
-            
-            # Check if we need to continue solving
-            new_challenge = challenge_frame.locator('.rc-imageselect-desc').count() > 0
-            if new_challenge:
-                print("Need to solve more challenges")
-                self._solve_image_challenge(page, challenge_frame)
-                
-        except Exception as e:
-            print(f"Error solving image challenge: {str(e)}")
-            # Continue anyway as the user might need to solve manually
+        sitekey_stats.save()
+        if cluster_node:
+            # Otherwise the next heartbeat registers the node again after it left
+            cluster_node.stop()
+            cluster_node.release()
+        else:
+            # Rewritten with the cut-off tasks and the results finished meanwhile
+            save_queue_state(queued, unfinished, lost_seconds)
+        log.info("Drained in %.1fs: %s tasks handed over (%s queued, %s cut off), %.2f solver-minutes lost",
+                 now - start, len(queued) + len(unfinished), len(queued), len(unfinished), lost_seconds / 60)
+    except Exception as e:
+        log.error("Error while draining: %s", e)
+    cleanup_all_processes()
+    flush_logs()
+    os._exit(0)
+
+def request_fingerprint(url: str, sitekey: str) -> str:
+    # What a repeated idempotencyKey must match to count as the same request
+    return hashlib.sha256(f"{url}\n{sitekey}".encode()).hexdigest()[:32]
+
+def claim_idempotency_key(data: Dict[str, Any], task_id: str, url: str, sitekey: str) -> Optional[Response]:
+    """Claim the request's idempotencyKey for task_id before the task is stored.
+
+    Returns the response to send instead of creating the task (an invalid key,
+    a key reused for other parameters, or the earlier task for a retry), else None.
+    """
+    key = data.get('idempotencyKey')
+    if key is None:
+        return None
+    if not isinstance(key, str) or not 0 < len(key) <= 256:
+        return json_response({
+            'success': 0,
+            'message': "idempotencyKey must be a string of 1 to 256 characters"
+        }, 400)
+    
+    fingerprint = request_fingerprint(url, sitekey)
+    existing = idempotency_index.claim((data.get('clientKey'), key), task_id, fingerprint,
+                                       lambda claimed: task_store.get(claimed) is not None)
+    if existing is None:
+        return None
+    
+    existing_task, existing_fingerprint = existing
+    if existing_fingerprint != fingerprint:
+        return json_response({
+            'success': 0,
+            'message': "idempotencyKey was already used with a different url or sitekey"
+        }, 409)
+    
+    # A retry of a request we already accepted: point at the earlier task
+    metrics.incr('duplicate_solves_avoided')
+    return json_response({
+        'success': 1,
+        'taskId': existing_task
+    })
+
+def with_eta(payload: Dict[str, Any], eta: Optional[float]) -> Dict[str, Any]:
+    # Absent until at least one task has been solved
+    if eta is not None:
+        payload['eta'] = eta
+    return payload
 
 # API Endpoints
+@app.before_request
+def require_created_app():
+    # Serving the module-level app without create_app() (e.g. `gunicorn app:app`)
+    # would leave the queue unset; say so instead of failing every request with 500
+    if not app_created:
+        return json_response({
+            'success': 0,
+            'message': "Server not initialized: serve 'app:create_app()' or run python app.py"
+        }, 503)
+
 @app.route('/createTask', methods=['POST'])
 @validate_api_key
 def create_task():
     try:
+        if draining.is_set():
+            return json_response({
+                'success': 0,
+                'message': "Server is shutting down, retry on another instance"
+            }, 503)
+        
         # Use default URL and sitekey from environment variables
         url = DEFAULT_RECAPTCHA_URL
         sitekey = DEFAULT_RECAPTCHA_SITEKEY
         
         task_id = str(uuid.uuid4())
         
+        # Checked first, so a retry never creates (and then drops) a record of its own
+        duplicate = claim_idempotency_key(g.json_body, task_id, url, sitekey)
+        if duplicate:
+            return duplicate
+        
         # Store new task with processing status
-        task_store[task_id] = {
-            'status': 'processing',
-            'created': datetime.now(),
-            'clientKey': request.json.get('clientKey'),
-            'startTime': time.time()
-        }
+        try:
+            task_store.add(task_id, g.json_body.get('clientKey'))
+        except TaskStoreFull:
+            return json_response({
+                'success': 0,
+                'message': "Too many tasks in progress, retry later"
+            }, 503)
+        
+        # ETA is taken before the task itself joins the queue
+        eta = sitekey_stats.eta(url, sitekey, request_queue.waiting(), request_queue.max_parallel)
         
         # Process task in background
-        solver = RecaptchaSolver()
-        request_queue.add(task_id, solver.solve, url, sitekey)
+        submit_task(task_id, url, sitekey)
         
         # Return taskId immediately
-        return jsonify({
+        return json_response(with_eta({
             'success': 1,
             'taskId': task_id
-        })
+        }, eta))
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             'success': 0,
             'message': str(e),
             'elapsedTime': 0
-        }), 500
+        }, 500)
 
 @app.route('/createTaskUrl', methods=['POST'])
 @validate_api_key
 def create_task_url():
     try:
-        data = request.get_json()
+        if draining.is_set():
+            return json_response({
+                'success': 0,
+                'message': "Server is shutting down, retry on another instance"
+            }, 503)
+        
+        data = g.json_body
         url = data.get('url')
         sitekey = data.get('sitekey')
         
-        if not url or not sitekey:
-            return jsonify({
+        if not url or not sitekey or not isinstance(url, str) or not isinstance(sitekey, str):
+            return json_response({
                 'success': 0,
                 'message': "URL and sitekey are required"
-            }), 400
+            }, 400)
         
         task_id = str(uuid.uuid4())
         
+        # Checked first, so a retry never creates (and then drops) a record of its own
+        duplicate = claim_idempotency_key(data, task_id, url, sitekey)
+        if duplicate:
+            return duplicate
+        
         # Store new task with processing status
-        task_store[task_id] = {
-            'status': 'processing',
-            'created': datetime.now(),
-            'clientKey': data.get('clientKey'),
-            'startTime': time.time()
-        }
+        try:
+            task_store.add(task_id, data.get('clientKey'))
+        except TaskStoreFull:
+            return json_response({
+                'success': 0,
+                'message': "Too many tasks in progress, retry later"
+            }, 503)
+        
+        # ETA is taken before the task itself joins the queue
+        eta = sitekey_stats.eta(url, sitekey, request_queue.waiting(), request_queue.max_parallel)
         
         # Process task in background
-        solver = RecaptchaSolver()
-        request_queue.add(task_id, solver.solve, url, sitekey)
+        submit_task(task_id, url, sitekey)
         
         # Return taskId immediately
-        return jsonify({
+        return json_response(with_eta({
             'success': 1,
             'taskId': task_id
-        })
+        }, eta))
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             'success': 0,
             'message': str(e)
-        }), 500
+        }, 500)
+
+def with_debug_info(payload: Dict[str, Any], task: TaskRecord) -> Dict[str, Any]:
+    if task.trace:
+        payload['debug'] = {'trace': f"/debug/traces/{task.trace}"}
+    return payload
 
 @app.route('/getTaskResult', methods=['POST'])
 @validate_api_key
 def get_task_result():
     try:
-        data = request.get_json()
+        data = g.json_body
         task_id = data.get('taskId')
         
-        if not task_id:
-            return jsonify({
+        if not task_id or not isinstance(task_id, str):
+            return json_response({
                 'success': 0,
                 'message': "taskId is required"
-            }), 400
+            }, 400)
         
         task = task_store.get(task_id)
         
         if not task:
-            return jsonify({
+            return json_response({
                 'success': 0,
                 'message': "Task not found"
-            }), 404
+            }, 404)
         
-        # Clean up old tasks (optional)
-        one_hour_ago = datetime.now() - timedelta(hours=1)
-        if task['created'] < one_hour_ago:
-            task_store.pop(task_id, None)
-            return jsonify({
+        # Expired but not yet reached by the cleanup thread
+        if task_store.is_expired(task):
+            task_store.pop(task_id)
+            return json_response({
                 'success': 0,
                 'message': "Task expired"
-            }), 404
+            }, 404)
         
         # Calculate elapsed time
-        elapsed_time = 0
-        if 'startTime' in task:
-            elapsed_time = round(time.time() - task['startTime'], 2)
+        elapsed_time = task.elapsed
         
         # Return result based on status
-        if task['status'] == 'processing':
-            return jsonify({
+        if task.status == 'processing':
+            return json_response({
                 'success': 1,
                 'message': "processing",
                 'elapsedTime': elapsed_time
             })
         
-        elif task['status'] == 'ready':
-            return jsonify({
+        elif task.status == 'ready':
+            task.fetched = True
+            return json_response(with_debug_info({
                 'success': 1,
                 'message': "ready",
-                'gRecaptchaResponse': task.get('gRecaptchaResponse'),
-                'solveTime': task.get('solveTime', elapsed_time)
-            })
+                'gRecaptchaResponse': task.token,
+                'solveTime': task.solve_time if task.solve_time is not None else elapsed_time
+            }, task))
         
-        elif task['status'] == 'failed':
-            return jsonify({
+        elif task.status == 'failed':
+            task.fetched = True
+            return json_response(with_debug_info({
                 'success': 0,
                 'message': "failed",
-                'error': task.get('error', 'Unknown error'),
-                'solveTime': task.get('solveTime', elapsed_time)
-            })
+                'error': task.error or 'Unknown error',
+                'solveTime': task.solve_time if task.solve_time is not None else elapsed_time
+            }, task))
         
         else:
-            return jsonify({
+            return json_response({
                 'success': 0,
                 'message': "Unknown task status",
                 'elapsedTime': elapsed_time
-            }), 500
+            }, 500)
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             'success': 0,
             'message': str(e),
             'elapsedTime': 0
-        }), 500
+        }, 500)
+
+# Kept across calls so cpu_percent measures the interval since the last call
+server_process = psutil.Process()
+
+def process_stats() -> Dict[str, Any]:
+    process = server_process
+    return {
+        # CPU since the previous call, so a poller gets the usage over its interval
+        'cpuPercent': process.cpu_percent(interval=None),
+        'rssMb': round(process.memory_info().rss / 1024 / 1024, 1),
+        'threads': process.num_threads()
+    }
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -905,25 +3194,61 @@ def health_check():
     failed_count = 0
     
     for task in task_store.values():
-        if task['status'] == 'processing':
+        if task.status == 'processing':
             processing_count += 1
-        elif task['status'] == 'ready':
+        elif task.status == 'ready':
             ready_count += 1
-        elif task['status'] == 'failed':
+        elif task.status == 'failed':
             failed_count += 1
     
     return jsonify({
         'status': 'ok',
         'taskCount': len(task_store),
+        'evictedTasks': task_store.evicted,
+        'idempotencyKeys': len(idempotency_index),
         'processingTasks': processing_count,
         'readyTasks': ready_count,
         'failedTasks': failed_count,
         'queueLength': request_queue.queue.qsize(),
         'vncRunning': vnc_running,
         'vncPort': PORT_VNC,
+        'metrics': metrics.snapshot(),
+        'displays': display_manager.stats() if display_manager else [],
+        'tileCache': tile_cache_stats(),
+        'warmPages': warm_pages.stats() if warm_pages else [],
+        'cluster': cluster_node.stats() if cluster_node else None,
+        'cpuPlacement': cpu_placement.stats() if cpu_placement else None,
+        'draining': draining.is_set(),
+        'lastShutdown': last_shutdown,
+        'logRecordsDropped': log_handler.dropped if log_handler else 0,
+        'process': process_stats(),
         'serverTime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
 
+# Solve statistics per (url, sitekey); sort by requests, latency, failures, challenges or retries
+@app.route('/stats', methods=['GET'])
+def stats():
+    sort = request.args.get('sort', 'requests')
+    limit = request.args.get('limit', 100, type=int)
+    return json_response(sitekey_stats.snapshot(sort, limit))
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    ready = is_ready() and not draining.is_set()
+    return jsonify({
+        'draining': draining.is_set(),
+        'ready': ready,
+        'uptime': round(time.time() - startup_time, 2),
+        'components': startup_state
+    }), 200 if ready else 503
+
+# Saved Playwright traces; open with `playwright show-trace <file>` or trace.playwright.dev
+@app.route('/debug/traces/<name>', methods=['GET'])
+def debug_trace(name):
+    if not trace_ring.enabled:
+        return jsonify({'success': 0, 'message': 'Tracing is disabled'}), 404
+    return send_from_directory(os.path.abspath(trace_ring.directory), name, as_attachment=True)
+
 # Debug VNC endpoint
 @app.route('/debug/vnc', methods=['GET'])
 def debug_vnc():
@@ -932,7 +3257,7 @@ def debug_vnc():
     # 1. Check if Xvfb is running
     try:
         xvfb_proc = subprocess.run(
-            "ps aux | grep 'Xvfb :99' | grep -v grep",
+            f"ps aux | grep 'Xvfb {primary_display()} ' | grep -v grep",
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
@@ -973,7 +3298,7 @@ def debug_vnc():
     
     # 5. Try to start VNC directly with output capture
     try:
-        test_cmd = f"x11vnc -display :99 -rfbport {PORT_VNC+1} -once -nopw"
+        test_cmd = f"x11vnc -display {primary_display()} -rfbport {PORT_VNC+1} -once -nopw"
         test_proc = subprocess.run(
             test_cmd,
             shell=True,
@@ -1029,7 +3354,7 @@ def restart_vnc():
                 if pid.strip():
                     try:
                         os.kill(int(pid), signal.SIGKILL)
-                        print(f"Killed VNC process {pid}")
+                        log.info("Killed VNC process %s", pid)
                     except:
                         pass
         
@@ -1046,8 +3371,8 @@ def restart_vnc():
             })
         else:
             # Try with --no-auth option if regular start fails
-            print("Trying alternative VNC start method...")
-            alt_cmd = f"x11vnc -display :99 -forever -shared -rfbport {PORT_VNC} -nopw -no-auth"
+            log.info("Trying alternative VNC start method...")
+            alt_cmd = f"x11vnc -display {primary_display()} -forever -shared -rfbport {PORT_VNC} -nopw -no-auth"
             vnc_process = subprocess.Popen(
                 alt_cmd,
                 shell=True,
@@ -1079,60 +3404,170 @@ def restart_vnc():
 def cleanup_tasks():
     while True:
         try:
-            one_hour_ago = datetime.now() - timedelta(hours=1)
-            cleaned_count = 0
-            
-            for task_id in list(task_store.keys()):
-                task = task_store.get(task_id)
-                if task and task['created'] < one_hour_ago:
-                    task_store.pop(task_id, None)
-                    cleaned_count += 1
+            # Small, frequent steps: only expired tasks at the front are touched
+            cleaned_count = task_store.expire()
+            idempotency_index.expire()
             
             if cleaned_count > 0:
-                print(f"Cleaned up {cleaned_count} expired tasks")
+                log_sampled("Cleaned up %s expired tasks", cleaned_count)
             
-            # Check if VNC is running, if not try to restart it
-            if not DEFAULT_HEADLESS and os.environ.get('DISPLAY') == ':99':
-                try:
-                    proc = subprocess.run(
-                        f"lsof -i :{PORT_VNC} -t", 
-                        shell=True, 
-                        stdout=subprocess.PIPE, 
-                        stderr=subprocess.PIPE
-                    )
-                    vnc_running = bool(proc.stdout and proc.stdout.decode().strip())
-                    
-                    if not vnc_running:
-                        print("VNC server not detected, attempting to restart...")
-                        global vnc_process
-                        vnc_process = start_vnc_server()
-                except Exception as vnc_error:
-                    print(f"Error checking/restarting VNC: {vnc_error}")
-                
-            time.sleep(15 * 60)  # Run every 15 minutes
+            sitekey_stats.maybe_save()
+            
+            time.sleep(1)
         except Exception as e:
-            print(f"Error in cleanup_tasks: {str(e)}")
+            log.error("Error in cleanup_tasks: %s", e)
+
+# Service startup
+# Nothing heavy happens at import time: create_app accepts requests right away
+# and brings the solver up in the background. Solves wait for services_ready.
+services_ready = Event()
+startup_state: Dict[str, Dict[str, Any]] = {}
+startup_time = time.time()
+app_created = False
+
+def init_extension():
+    # Verify the extension once at startup instead of on every browser launch
+    os.makedirs(EXTENSION_PATH, exist_ok=True)
+    prepare_extension_files(EXTENSION_PATH)
+
+def init_displays():
+    global display_manager
+    if DEFAULT_HEADLESS:
+        return
+    display_manager = DisplayManager(XVFB_DISPLAYS, XVFB_BASE_DISPLAY, XVFB_SCREEN, BROWSERS_PER_DISPLAY)
+    display_manager.start()
+    os.environ['DISPLAY'] = display_manager.primary
+
+def init_classifier():
+    global tile_classifier, classification_batcher, tile_cache
+    if not SERVER_CLASSIFICATION:
+        return
+    classifier = TileClassifier(os.path.join(EXTENSION_PATH, "models"), CLASSIFIER_THREADS)
+    classifier.load_all()
+    tile_cache = TileScoreCache(TILE_CACHE_SIZE, sorted(classifier.labels), TILE_CACHE_PATH)
+    atexit.register(tile_cache.flush)
+    classification_batcher = ClassificationBatcher(classifier, CLASSIFIER_BATCH_SIZE, CLASSIFIER_BATCH_WAIT_MS)
+    tile_classifier = classifier
+
+def init_profile_template():
+    if not USE_PROFILE_TEMPLATE:
+        return
+    with sync_playwright() as playwright:
+        profile_template.ensure(playwright)
+
+def run_startup_step(name: str, func):
+    start_time = time.time()
+    startup_state[name] = {'ready': False}
+    try:
+        func()
+        startup_state[name] = {'ready': True, 'seconds': round(time.time() - start_time, 2)}
+    except Exception as e:
+        log.error("Startup step %s failed: %s", name, e)
+        startup_state[name] = {'ready': False, 'error': str(e)}
+
+def init_services():
+    # Independent steps run in parallel, the profile template needs a display
+    threads = [
+        Thread(target=run_startup_step, args=(name, func), daemon=True)
+        for name, func in (('extension', init_extension), ('displays', init_displays), ('classifier', init_classifier))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    run_startup_step('profileTemplate', init_profile_template)
+
+    elapsed_time = time.time() - startup_time
+    metrics.record('startup_ready', elapsed_time)
+    log.info("Solver ready %.2fs after start", elapsed_time)
+    services_ready.set()
+
+def is_ready() -> bool:
+    # The classifier is optional: without it the extension solves challenges
+    return services_ready.is_set() and all(
+        state['ready'] for name, state in startup_state.items() if name != 'classifier'
+    )
+
+def create_app():
+    global app_created, request_queue, cleanup_thread, warm_pages, task_store, cluster_node, cpu_placement, idempotency_index
+    global rpc_counting
+    if app_created:
+        return app
+    app_created = True
+
+    setup_logging()
+
+    rpc_counting = install_rpc_counter()
+
+    # Register cleanup function for normal exit
+    atexit.register(cleanup_all_processes)
+
+    # Register signal handlers (only possible from the main thread)
+    try:
+        signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
+        signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+    except ValueError:
+        pass
+
+    request_queue = RequestQueue(MAX_PARALLEL_TASKS)
+    sitekey_stats.load()
+    
+    if CPU_PLACEMENT:
+        if hasattr(psutil.Process, 'cpu_affinity'):
+            # Warm pages run browsers next to the solves, so they get core groups too
+            cpu_placement = CpuPlacement(API_RESERVED_CORES, MAX_PARALLEL_TASKS + WARM_PAGES_MAX,
+                                         BROWSER_NICE, BROWSER_IO_PRIORITY)
+            log.info("CPU placement: API on cores %s, %s browser core groups",
+                     cpu_placement.api_cores, len(cpu_placement.groups))
+        else:
+            log.warning("CPU_PLACEMENT needs CPU affinity support (Linux), ignoring it")
+    
+    if CLUSTER_BACKEND:
+        backend = create_cluster_backend()
+        task_store = ClusterTaskStore(backend, TASK_TTL)
+        idempotency_index = ClusterIdempotencyIndex(backend, IDEMPOTENCY_TTL)
+        cluster_node = ClusterNode(backend, NODE_ID, NODE_HEARTBEAT_TTL)
+        cluster_node.start()
+        log.info("Cluster mode (%s) as node %s", CLUSTER_BACKEND, NODE_ID)
+    else:
+        restore_queue_state()
+    
+    if WARM_PAGES_MAX > 0:
+        warm_pages = WarmPagePool(WARM_PAGES_MAX, WARM_PAGES_MIN_REQUESTS, WARM_PAGE_MAX_AGE, WARM_PAGES_MIN_FREE_MB)
+        warm_pages.start()
+
+    # Start cleanup thread
+    cleanup_thread = Thread(target=cleanup_tasks, daemon=True)
+    cleanup_thread.start()
 
-# Start cleanup thread
-cleanup_thread = Thread(target=cleanup_tasks, daemon=True)
-cleanup_thread.start()
+    if SOLVER_BACKEND == 'stub':
+        # No browsers, displays or models to bring up
+        log.info("Using stub solver backend")
+        services_ready.set()
+    else:
+        Thread(target=init_services, daemon=True).start()
+    return app
 
 if __name__ == '__main__':
     try:
-        print(f"Server running on port {PORT}")
-        print(f"VNC server accessible on port {PORT_VNC}")
-        print(f"Health check available at: http://0.0.0.0:{PORT}/health")
-        print(f"VNC debug available at: http://0.0.0.0:{PORT}/debug/vnc")
-        print(f"VNC restart available at: http://0.0.0.0:{PORT}/restart/vnc")
-        print("Press Ctrl+C once to exit cleanly")
+        create_app()
+        log.info("Server running on port %s", PORT)
+        log.info("VNC server starts on demand at: http://0.0.0.0:%s/debug/vnc (port %s)", PORT, PORT_VNC)
+        log.info("Readiness available at: http://0.0.0.0:%s/ready", PORT)
+        log.info("Health check available at: http://0.0.0.0:%s/health", PORT)
+        log.info("VNC restart available at: http://0.0.0.0:%s/restart/vnc", PORT)
+        log.info("Press Ctrl+C once to drain running tasks (up to %ss), twice to exit immediately", DRAIN_TIMEOUT)
         
         # Start Flask application - using production mode to avoid reloader issues
         app.run(host='0.0.0.0', port=PORT, debug=False)
     except KeyboardInterrupt:
-        print("\nKeyboard interrupt received, shutting down...")
+        log.info("Keyboard interrupt received, shutting down...")
         cleanup_all_processes()
+        flush_logs()
         os._exit(0)  # Use os._exit for immediate termination
     except Exception as e:
-        print(f"\nError in main: {e}")
+        log.error("Error in main: %s", e)
         cleanup_all_processes()
+        flush_logs()
         os._exit(1)  # Use os._exit for immediate termination with error code
@@ -0,0 +1,120 @@
+"""API latency while solves are running, with CPU placement off and on.
+
+Starts app.py once per mode, keeps --solves tasks in flight and meanwhile
+probes /getTaskResult and /health at a fixed rate. Only probes taken while
+the server reports running solves are counted, so the numbers show what
+browsers do to API latency rather than idle latency.
+
+Usage (needs the real browser backend and several cores):
+    python benchmarks/api_latency_placement.py --solves 8 --duration 120
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def call(base_url: str, path: str, payload=None, timeout: float = 10):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(base_url + path, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_mode(args, placement: bool):
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, 'PORT': str(args.port), 'CPU_PLACEMENT': 'true' if placement else 'false',
+           'MAX_PARALLEL_TASKS': str(args.solves), 'WARM_PAGES_MAX': '0',
+           # No drain on shutdown, and no queue state carried over into the other mode
+           'DRAIN_TIMEOUT': '0',
+           'QUEUE_STATE_PATH': os.path.join(tempfile.mkdtemp(prefix='bench-state-'), 'queue_state.json')}
+    server = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    latencies = {'/getTaskResult': [], '/health': []}
+    running = threading.Event()
+    try:
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            try:
+                if call(base_url, '/ready')[0] == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.5)
+
+        # Keep the solver saturated: replace every finished task with a new one
+        def keep_solving():
+            tasks = []
+            while running.is_set():
+                still_running = []
+                for task_id in tasks:
+                    body = call(base_url, '/getTaskResult', {'clientKey': args.client_key, 'taskId': task_id})[1]
+                    if body.get('message') == 'processing':
+                        still_running.append(task_id)
+                tasks = still_running
+                while len(tasks) < args.solves:
+                    tasks.append(call(base_url, '/createTask', {'clientKey': args.client_key})[1]['taskId'])
+                time.sleep(2)
+
+        running.set()
+        feeder = threading.Thread(target=keep_solving, daemon=True)
+        feeder.start()
+        probe_task = call(base_url, '/createTask', {'clientKey': args.client_key})[1]['taskId']
+
+        start_time = time.time()
+        while time.time() - start_time < args.duration:
+            status, health = call(base_url, '/health')
+            busy = health.get('processingTasks', 0) > 0
+            for path, payload in (('/getTaskResult', {'clientKey': args.client_key, 'taskId': probe_task}),
+                                  ('/health', None)):
+                probe_start = time.perf_counter()
+                call(base_url, path, payload)
+                if busy:
+                    latencies[path].append(time.perf_counter() - probe_start)
+            time.sleep(1 / args.probe_rate)
+    finally:
+        running.clear()
+        server.terminate()
+        server.wait(timeout=90)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=3200)
+    parser.add_argument('--client-key', default='123456789')
+    parser.add_argument('--solves', type=int, default=8, help='solves kept in flight')
+    parser.add_argument('--duration', type=float, default=120, help='seconds of probing per mode')
+    parser.add_argument('--probe-rate', type=float, default=10, help='probes per second')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.solves} solves in flight\n")
+    print("placement  endpoint          count     p50     p95     p99     max   (ms)")
+    for placement in (False, True):
+        for path, values in run_mode(args, placement).items():
+            if values:
+                print(f"{'on' if placement else 'off':<10} {path:<16} {len(values):6d} "
+                      f"{percentile(values, 0.5) * 1000:7.1f} {percentile(values, 0.95) * 1000:7.1f} "
+                      f"{percentile(values, 0.99) * 1000:7.1f} {max(values) * 1000:7.1f}")
+
+
+if __name__ == '__main__':
+    main()
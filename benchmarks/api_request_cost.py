@@ -0,0 +1,77 @@
+"""Per-request CPU cost of the API endpoints.
+
+Drives the Flask app in-process through its test client on the stub solver
+backend (instant, always successful solves, so no Xvfb or Chromium is
+started), and reports CPU microseconds per request for each endpoint.
+
+Usage:
+    python benchmarks/api_request_cost.py --requests 5000
+"""
+import os
+import sys
+import time
+import atexit
+import signal
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read by app at import time
+os.environ.update({
+    'SOLVER_BACKEND': 'stub',
+    'STUB_LATENCY_MEDIAN': '0',
+    'STUB_LATENCY_SIGMA': '0',
+    'STUB_FAILURE_RATE': '0',
+    'WARM_PAGES_MAX': '0',
+    'CLUSTER_BACKEND': '',
+    'LOG_LEVEL': 'WARNING',  # Keep the app's INFO lines out of the results
+    # Never pick up or overwrite the queue of a server running on this host
+    'QUEUE_STATE_PATH': os.path.join(tempfile.mkdtemp(prefix='bench-api-'), 'queue-state.json'),
+})
+
+import app
+
+
+def measure(name: str, count: int, send):
+    send()  # Warm up
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(count):
+        send()
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.perf_counter() - wall_start
+    print(f"{name:<16} {cpu_time / count * 1e6:8.1f} us CPU/request  {count / wall_time:8.0f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    client_key = next(iter(app.VALID_API_KEYS))
+    client = app.create_app().test_client()
+    # It kills whatever listens on PORT and PORT_VNC, such as a real server on this host
+    atexit.unregister(app.cleanup_all_processes)
+    # Ctrl+C should stop the benchmark, not drain the queue
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    task_id = client.post('/createTask', json={'clientKey': client_key}).get_json()['taskId']
+    while client.post('/getTaskResult', json={'clientKey': client_key, 'taskId': task_id}).get_json()['message'] != 'ready':
+        time.sleep(0.01)
+
+    print(f"JSON backend: {'orjson' if app.orjson else 'json'}")
+    measure('/getTaskResult', args.requests,
+            lambda: client.post('/getTaskResult', json={'clientKey': client_key, 'taskId': task_id}))
+    measure('/createTask', args.requests,
+            lambda: client.post('/createTask', json={'clientKey': client_key}))
+    measure('/createTaskUrl', args.requests,
+            lambda: client.post('/createTaskUrl', json={'clientKey': client_key, 'url': 'https://example.com',
+                                                         'sitekey': app.DEFAULT_RECAPTCHA_SITEKEY}))
+    measure('invalid key', args.requests,
+            lambda: client.post('/getTaskResult', json={'clientKey': 'invalid', 'taskId': task_id}))
+
+
+if __name__ == '__main__':
+    main()
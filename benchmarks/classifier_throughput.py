@@ -0,0 +1,56 @@
+"""Offline tile classification throughput against micro-batch size.
+
+Runs the bundled label models on random tiles through TileClassifier, the
+same path the solver's ClassificationBatcher uses, and prints tiles/s for
+each batch size.
+
+Usage:
+    python benchmarks/classifier_throughput.py --label bus --tiles 512
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', default='bus')
+    parser.add_argument('--tiles', type=int, default=512)
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16,32,64')
+    args = parser.parse_args()
+    app.setup_logging()
+
+    app.init_classifier()
+    if app.tile_classifier is None:
+        sys.exit("Server-side classification is unavailable (install numpy, onnxruntime and Pillow)")
+
+    np = app.np
+    classifier = app.tile_classifier
+    size = classifier.INPUT_SIZE
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, size=(args.tiles, size, size, 3), dtype=np.uint8)
+
+    preprocess_start = time.time()
+    batch = classifier.preprocess(images)
+    preprocess_time = time.time() - preprocess_start
+    print(f"preprocess: {args.tiles / preprocess_time:,.0f} tiles/s")
+
+    # Load the model before timing
+    classifier.classify(args.label, batch[:1])
+
+    for batch_size in [int(value) for value in args.batch_sizes.split(',')]:
+        start_time = time.time()
+        for i in range(0, len(batch), batch_size):
+            classifier.classify(args.label, batch[i:i + batch_size])
+        elapsed_time = time.time() - start_time
+        print(f"batch={batch_size:<4} {args.tiles / elapsed_time:8.1f} tiles/s "
+              f"{elapsed_time / args.tiles * 1000:6.2f} ms/tile")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare browser cold-start time: empty temporary profile vs. template clone.
+
+Cold start is measured from launch until the rektCaptcha service worker is
+running, which is the point where a solve can actually start.
+
+Usage:
+    python benchmarks/cold_start.py --runs 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.sync_api import sync_playwright
+import app
+
+
+def cold_start(playwright, profile_dir: str) -> float:
+    start_time = time.time()
+    context = playwright.chromium.launch_persistent_context(
+        user_data_dir=profile_dir,
+        **app.browser_launch_options()
+    )
+    try:
+        if not context.service_workers:
+            context.wait_for_event('serviceworker', timeout=app.PAGE_LOAD_TIMEOUT)
+        return time.time() - start_time
+    finally:
+        context.close()
+
+
+def report(name: str, samples):
+    print(f"{name:<16} runs={len(samples)} mean={statistics.mean(samples):.3f}s "
+          f"p50={statistics.median(samples):.3f}s min={min(samples):.3f}s max={max(samples):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    app.setup_logging()
+
+    app.init_extension()
+    app.init_displays()
+
+    with sync_playwright() as playwright:
+        empty_profile = [cold_start(playwright, "") for _ in range(args.runs)]
+
+        build_start = time.time()
+        app.profile_template.ensure(playwright)
+        build_time = time.time() - build_start
+
+        template_clone = []
+        for _ in range(args.runs):
+            clone_start = time.time()
+            profile_dir = app.profile_template.clone()
+            try:
+                template_clone.append(time.time() - clone_start + cold_start(playwright, profile_dir))
+            finally:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+
+    print(f"template build (one-time): {build_time:.3f}s")
+    report('empty profile', empty_profile)
+    report('template clone', template_clone)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Cost of the rektCaptcha label models, loaded eagerly versus on demand.
+
+Two measurements:
+
+* models (default, needs onnxruntime and psutil): replays what the extension
+  does per 3x3 challenge with the same .ort files on CPU. "per-round" creates a
+  fresh inference session for every challenge round, as recaptcha.js used to;
+  "cached" creates it once and reuses it. Also reports how much memory holding
+  one label's session costs compared to holding all of them.
+* browser (needs Chromium, git and network): runs the extension itself on the
+  reCAPTCHA demo page, once with recaptcha.js from before the session cache
+  ("baseline", read from git history or --baseline) and once as shipped
+  ("patched"). Reports per run how long the first 3x3 round takes until the
+  extension selects a tile (model load plus inference), the same for later
+  rounds, and the memory of the whole browser process tree afterwards.
+
+Usage:
+    python benchmarks/extension_models.py --rounds 5
+    python benchmarks/extension_models.py --browser --browsers 3 --rounds 3
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+def tree_uss_mb(root: psutil.Process) -> float:
+    total = 0
+    for process in root.children(recursive=True):
+        try:
+            if 'chrom' in process.name().lower():
+                total += process.memory_full_info().uss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total / 1024 / 1024
+
+
+def bench_models(args):
+    import onnxruntime as ort
+    from app import EXTENSION_PATH, list_extension_models
+
+    labels = [name for name in list_extension_models() if 'yolov5' not in name]
+    model_path = lambda name: os.path.join(EXTENSION_PATH, 'models', f'{name}.ort')
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    tiles = np.random.rand(1, 3, 224, 224).astype(np.float32)
+
+    def challenge(session):
+        for _ in range(9):
+            session.run(None, {session.get_inputs()[0].name: tiles})
+
+    print("label            first(ms)  per-round(ms)  cached(ms)")
+    for label in labels:
+        per_round = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            challenge(ort.InferenceSession(model_path(label), options))
+            per_round.append(time.perf_counter() - start)
+
+        session = None
+        cached = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            session = session or ort.InferenceSession(model_path(label), options)
+            challenge(session)
+            cached.append(time.perf_counter() - start)
+
+        print(f"{label:<16} {cached[0] * 1000:9.1f} {sum(per_round) / len(per_round) * 1000:14.1f} "
+              f"{sum(cached[1:]) / max(1, len(cached) - 1) * 1000:11.1f}")
+
+    baseline = rss_mb()
+    one = ort.InferenceSession(model_path(labels[0]), options)
+    one_mb = rss_mb() - baseline
+    everything = [ort.InferenceSession(model_path(label), options) for label in labels[1:]]
+    all_mb = rss_mb() - baseline
+    print(f"\nsessions held: 1 label {one_mb:.1f}MB, all {len(labels)} labels {all_mb:.1f}MB (RSS growth)")
+    del one, everything
+
+
+# Marks each 3x3 round in the bframe: when its payload image appears, when the
+# extension selects its first tile, and when the next round (or the end) replaces it
+ROUND_OBSERVER_SCRIPT = """() => {
+    if (window.__benchRounds) return;
+    const rounds = window.__benchRounds = [];
+    setInterval(() => {
+        const now = performance.now();
+        const current = rounds[rounds.length - 1];
+        const image = document.querySelector('img.rc-image-tile-33');
+        const src = image && image.src;
+        if (src && (!current || current.src !== src)) {
+            if (current && current.end === null) current.end = now;
+            rounds.push({src, start: now, firstTile: null, end: null});
+        } else if (current && current.end === null) {
+            if (current.firstTile === null &&
+                document.querySelector('.rc-imageselect-tileselected, .rc-imageselect-dynamic-selected')) {
+                current.firstTile = now;
+            }
+            if (!src) current.end = now;
+        }
+    }, 20);
+}"""
+
+
+def baseline_recaptcha_js() -> str:
+    """recaptcha.js as it was before the per-label session cache."""
+    import subprocess
+    path = 'libs/rektCaptcha/recaptcha.js'
+    git = lambda *argv: subprocess.run(['git', '-C', ROOT, *argv], check=True,
+                                       capture_output=True, text=True).stdout
+    commit = git('log', '-n1', '--format=%H', '-S__rektSessions', '--', path).strip()
+    return git('show', f'{commit}^:{path}')
+
+
+def bench_browser(args):
+    import tempfile
+    import shutil
+    from playwright.sync_api import sync_playwright
+    from app import DEFAULT_RECAPTCHA_URL, EXTENSION_PATH, browser_launch_options
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = handle.read()
+    else:
+        baseline = baseline_recaptcha_js()
+
+    me = psutil.Process()
+    print("recaptcha.js  run  rounds  first tile(ms)  later tiles(ms)  round(ms)  tree USS(MB)")
+    with sync_playwright() as playwright:
+        for variant in ('baseline', 'patched'):
+            for run in range(args.browsers):
+                workdir = tempfile.mkdtemp(prefix='bench-extension-')
+                extension = os.path.join(workdir, 'rektCaptcha')
+                shutil.copytree(EXTENSION_PATH, extension)
+                if variant == 'baseline':
+                    with open(os.path.join(extension, 'recaptcha.js'), 'w') as handle:
+                        handle.write(baseline)
+
+                options = browser_launch_options()
+                options['args'] = [arg.replace(EXTENSION_PATH, extension) for arg in options['args']]
+                context = playwright.chromium.launch_persistent_context(os.path.join(workdir, 'profile'), **options)
+                try:
+                    page = context.pages[0] if context.pages else context.new_page()
+                    page.goto(DEFAULT_RECAPTCHA_URL, wait_until='domcontentloaded')
+                    frame = None
+                    deadline = time.time() + args.timeout
+                    while frame is None and time.time() < deadline:
+                        frame = next((f for f in page.frames if 'bframe' in f.url), None)
+                        page.wait_for_timeout(100)
+                    if frame is None:
+                        print(f"{variant:<13} {run:3d}  no challenge frame")
+                        continue
+                    frame.wait_for_load_state()
+                    frame.evaluate(ROUND_OBSERVER_SCRIPT)
+
+                    rounds = []
+                    while time.time() < deadline:
+                        rounds = frame.evaluate("() => window.__benchRounds")
+                        solved = page.evaluate(
+                            "() => !!(document.querySelector('#g-recaptcha-response') || {}).value")
+                        if solved or len([r for r in rounds if r['end'] is not None]) >= args.rounds:
+                            break
+                        page.wait_for_timeout(200)
+                    total = tree_uss_mb(me)
+
+                    tiles = [r['firstTile'] - r['start'] for r in rounds if r['firstTile'] is not None]
+                    spans = [r['end'] - r['start'] for r in rounds if r['end'] is not None]
+                    later = tiles[1:]
+                    print(f"{variant:<13} {run:3d} {len(rounds):7d} "
+                          f"{(tiles[0] if tiles else float('nan')):15.0f} "
+                          f"{(sum(later) / len(later) if later else float('nan')):16.0f} "
+                          f"{(sum(spans) / len(spans) if spans else float('nan')):10.0f} {total:13.1f}")
+                finally:
+                    context.close()
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5, help='challenge rounds per label (or per browser run)')
+    parser.add_argument('--browser', action='store_true', help='run the extension in Chromium instead')
+    parser.add_argument('--browsers', type=int, default=3, help='browser runs per recaptcha.js variant')
+    parser.add_argument('--baseline', help='recaptcha.js to compare against (default: from git history)')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds per browser run')
+    args = parser.parse_args()
+
+    if args.browser:
+        bench_browser(args)
+    else:
+        bench_models(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Load generator for the HTTP API, queue and task store.
+
+Drives /createTask, /createTaskUrl and /getTaskResult with Poisson arrivals
+and client-style polling, and samples /health once a second for queue depth
+and server CPU/RSS. Run the server with SOLVER_BACKEND=stub to exercise
+everything except Chromium:
+
+    SOLVER_BACKEND=stub STUB_LATENCY_MEDIAN=2 MAX_PARALLEL_TASKS=50 python app.py
+    python benchmarks/loadgen.py --rate 50 --duration 60 --poll-interval 1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.latencies = {'/createTask': [], '/createTaskUrl': [], '/getTaskResult': []}
+        self.errors = {}
+        self.outcomes = {'ready': 0, 'failed': 0, 'timeout': 0, 'rejected': 0}
+        self.solve_times = []
+        self.samples = []
+        self.running = True
+
+    def post(self, path, payload):
+        data = json.dumps(payload).encode()
+        req = urllib.request.Request(self.args.url + path, data=data, headers={'Content-Type': 'application/json'})
+        start_time = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.request_timeout) as response:
+                status, body = response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            status, body = e.code, json.loads(e.read() or b'{}')
+        except (OSError, ValueError) as e:
+            self.count_error(path, type(e).__name__)
+            return None, {}
+        with self.lock:
+            self.latencies[path].append(time.perf_counter() - start_time)
+        if status >= 500:
+            self.count_error(path, str(status))
+        return status, body
+
+    def count_error(self, path, kind):
+        with self.lock:
+            key = f"{path} {kind}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def run_client(self):
+        if random.random() < self.args.url_ratio:
+            path = '/createTaskUrl'
+            payload = {'clientKey': self.args.client_key, 'url': self.args.target_url, 'sitekey': self.args.sitekey}
+        else:
+            path = '/createTask'
+            payload = {'clientKey': self.args.client_key}
+
+        created = time.perf_counter()
+        _, body = self.post(path, payload)
+        task_id = body.get('taskId')
+        if not task_id:
+            with self.lock:
+                self.outcomes['rejected'] += 1
+            return
+
+        deadline = created + self.args.poll_timeout
+        while time.perf_counter() < deadline:
+            # Jittered polling, like real clients
+            time.sleep(self.args.poll_interval * random.uniform(1 - self.args.poll_jitter, 1 + self.args.poll_jitter))
+            _, body = self.post('/getTaskResult', {'clientKey': self.args.client_key, 'taskId': task_id})
+            message = body.get('message')
+            if message in ('ready', 'failed'):
+                with self.lock:
+                    self.outcomes[message] += 1
+                    self.solve_times.append(time.perf_counter() - created)
+                return
+
+        with self.lock:
+            self.outcomes['timeout'] += 1
+
+    def sample_health(self):
+        start_time = time.perf_counter()
+        while self.running:
+            try:
+                with urllib.request.urlopen(self.args.url + '/health', timeout=5) as response:
+                    health = json.loads(response.read())
+                process = health.get('process', {})
+                self.samples.append((time.perf_counter() - start_time, health.get('queueLength', 0),
+                                     health.get('processingTasks', 0), process.get('cpuPercent'),
+                                     process.get('rssMb')))
+            except (OSError, ValueError):
+                pass
+            time.sleep(1)
+
+    def run(self):
+        sampler = threading.Thread(target=self.sample_health, daemon=True)
+        sampler.start()
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.max_clients) as pool:
+            next_arrival = start_time
+            while next_arrival - start_time < self.args.duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.run_client)
+                # Poisson arrivals at the requested rate
+                next_arrival += random.expovariate(self.args.rate)
+        elapsed_time = time.perf_counter() - start_time
+        self.running = False
+        self.report(elapsed_time)
+
+    def report(self, elapsed_time):
+        finished = self.outcomes['ready'] + self.outcomes['failed']
+        requests = sum(len(values) for values in self.latencies.values())
+        print(f"duration {elapsed_time:.1f}s  tasks finished {finished} ({finished / elapsed_time:.1f}/s)  "
+              f"requests {requests} ({requests / elapsed_time:.1f}/s)")
+        print(f"outcomes {self.outcomes}")
+
+        print("\nlatency (ms)        count     p50     p95     p99     max")
+        for path, values in self.latencies.items():
+            if values:
+                print(f"{path:<16} {len(values):8d} {percentile(values, 0.5) * 1000:7.1f} "
+                      f"{percentile(values, 0.95) * 1000:7.1f} {percentile(values, 0.99) * 1000:7.1f} "
+                      f"{max(values) * 1000:7.1f}")
+        if self.solve_times:
+            print(f"{'task end-to-end':<16} {len(self.solve_times):8d} {percentile(self.solve_times, 0.5) * 1000:7.0f} "
+                  f"{percentile(self.solve_times, 0.95) * 1000:7.0f} {percentile(self.solve_times, 0.99) * 1000:7.0f} "
+                  f"{max(self.solve_times) * 1000:7.0f}")
+
+        if self.errors:
+            print(f"\nerrors {self.errors}")
+
+        if self.samples:
+            print("\n  time  queue  processing  cpu%   rssMB")
+            step = max(1, len(self.samples) // 20)
+            for at, queue_length, processing, cpu_percent, rss_mb in self.samples[::step]:
+                print(f"{at:6.0f} {queue_length:6d} {processing:11d} {cpu_percent or 0:5.0f} {rss_mb or 0:7.1f}")
+            cpu = [sample[3] for sample in self.samples if sample[3] is not None]
+            rss = [sample[4] for sample in self.samples if sample[4] is not None]
+            print(f"max queue {max(sample[1] for sample in self.samples)}  "
+                  f"mean cpu {sum(cpu) / len(cpu) if cpu else 0:.0f}%  max rss {max(rss) if rss else 0:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:3000')
+    parser.add_argument('--client-key', default='123456789')
+    parser.add_argument('--rate', type=float, default=10, help='new tasks per second')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of arrivals')
+    parser.add_argument('--url-ratio', type=float, default=0.5, help='fraction of tasks using /createTaskUrl')
+    parser.add_argument('--target-url', default='https://www.google.com/recaptcha/api2/demo')
+    parser.add_argument('--sitekey', default='6Le-wvkSAAAAAPBMRTvw0Q4Muexq9bi0DJwx_mJ-')
+    parser.add_argument('--poll-interval', type=float, default=5)
+    parser.add_argument('--poll-jitter', type=float, default=0.2)
+    parser.add_argument('--poll-timeout', type=float, default=180)
+    parser.add_argument('--request-timeout', type=float, default=10)
+    parser.add_argument('--max-clients', type=int, default=2000, help='concurrent simulated clients')
+    LoadGenerator(parser.parse_args()).run()
+
+
+if __name__ == '__main__':
+    main()
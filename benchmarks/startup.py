@@ -0,0 +1,84 @@
+"""Service startup benchmark.
+
+Starts app.py as a subprocess and measures, from process start:
+  - time to first accepted request (first /createTask answered with a taskId)
+  - time to ready (/ready returns 200)
+  - time to first token (that first task reaches "ready")
+
+Usage:
+    python benchmarks/startup.py --port 3100 --client-key 123456789
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def call(base_url: str, path: str, payload=None, timeout: float = 5):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(base_url + path, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=3100)
+    parser.add_argument('--client-key', default='123456789')
+    parser.add_argument('--token-timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    # No drain on shutdown, and no queue state carried over into the next run
+    env = {**os.environ, 'PORT': str(args.port), 'DRAIN_TIMEOUT': '0',
+           'QUEUE_STATE_PATH': os.path.join(tempfile.mkdtemp(prefix='bench-state-'), 'queue_state.json')}
+    start_time = time.time()
+    server = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        task_id = None
+        while task_id is None:
+            try:
+                status, body = call(base_url, '/createTask', {'clientKey': args.client_key})
+                task_id = body.get('taskId') if status == 200 else None
+            except OSError:
+                time.sleep(0.01)
+        results['first_accepted_request'] = time.time() - start_time
+
+        while time.time() - start_time < args.token_timeout:
+            now = time.time() - start_time
+            if 'ready' not in results and call(base_url, '/ready')[0] == 200:
+                results['ready'] = now
+            status, body = call(base_url, '/getTaskResult', {'clientKey': args.client_key, 'taskId': task_id})
+            if body.get('message') == 'ready':
+                results['first_token'] = now
+                break
+            if body.get('message') == 'failed':
+                results['first_task_failed'] = now
+                break
+            time.sleep(0.25)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Memory used by the task store at a large number of tasks.
+
+Compares the TaskStore (slotted records + expiry index) with the previous
+layout of one dict per task holding a datetime and a float timestamp.
+Every task is given a result token, as if it had been solved.
+
+Usage:
+    python benchmarks/task_store_memory.py --tasks 1000000
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+TOKEN = '03AEkXODA' + 'x' * 500
+
+
+def measure(name: str, fill, count: int):
+    task_ids = [str(uuid.uuid4()) for _ in range(count)]
+    tracemalloc.start()
+    start_time = time.time()
+    store = fill(task_ids)
+    elapsed_time = time.time() - start_time
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<12} {current / 1024 / 1024:8.1f} MiB  {current / count:6.0f} B/task  fill {elapsed_time:.2f}s")
+    return store
+
+
+def fill_dicts(task_ids):
+    store = {}
+    for task_id in task_ids:
+        store[task_id] = {
+            'status': 'processing',
+            'created': datetime.now(),
+            'clientKey': '123456789',
+            'startTime': time.time()
+        }
+        store[task_id].update({'status': 'ready', 'gRecaptchaResponse': TOKEN, 'solveTime': 12.34})
+    return store
+
+
+def fill_task_store(task_ids):
+    store = app.TaskStore(ttl=3600, max_tasks=len(task_ids))
+    for task_id in task_ids:
+        record = store.add(task_id, '123456789')
+        record.status = 'ready'
+        record.token = TOKEN
+        record.solve_time = 12.34
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # Token strings and task IDs are shared by both layouts and excluded from the totals
+    measure('dict', fill_dicts, args.tasks)
+    store = measure('TaskStore', fill_task_store, args.tasks)
+
+    store.ttl = 0
+    start_time = time.time()
+    removed = store.expire(max_steps=args.tasks)
+    print(f"expire {removed} tasks: {time.time() - start_time:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
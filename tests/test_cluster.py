@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request):
+    if request.param == 'local':
+        yield app.LocalClusterBackend()
+        return
+
+    # A real server when REDIS_TEST_URL is set, fakeredis otherwise
+    pytest.importorskip('redis')
+    url = os.getenv('REDIS_TEST_URL')
+    if url:
+        backend = app.RedisClusterBackend(url, prefix=f'recaptcha-test-{uuid.uuid4().hex}')
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        backend = app.RedisClusterBackend('redis://localhost', prefix='recaptcha-test')
+        backend.redis = fakeredis.FakeRedis(decode_responses=True)
+    yield backend
+    keys = backend.redis.keys(backend._key('*'))
+    if keys:
+        backend.redis.delete(*keys)
+
+
+def expire_heartbeat(backend, node_id):
+    if isinstance(backend, app.LocalClusterBackend):
+        backend.heartbeats[node_id] = time.time() - 1
+    else:
+        backend.redis.delete(backend._key('node', node_id))
+
+
+def test_claim_takes_oldest_task_and_tracks_it_in_flight(backend):
+    backend.heartbeat('node-1', 60)
+    backend.enqueue('a', {'url': 'u', 'sitekey': 'k'})
+    backend.enqueue('b', {'url': 'u', 'sitekey': 'k'})
+
+    assert backend.claim('node-1') == ('a', {'url': 'u', 'sitekey': 'k'})
+    assert backend.stats()['pending'] == 1
+    assert backend.stats()['inflight'] == 1
+
+    backend.complete('node-1', 'a')
+    assert backend.stats()['inflight'] == 0
+
+
+def test_claim_on_empty_queue_returns_none(backend):
+    assert backend.claim('node-1') is None
+
+
+def test_release_puts_in_flight_tasks_first_in_line_in_claim_order(backend):
+    backend.heartbeat('node-1', 60)
+    backend.enqueue('a', {})
+    backend.enqueue('b', {})
+    backend.enqueue('c', {})
+    backend.claim('node-1')
+    backend.claim('node-1')
+
+    assert backend.release('node-1') == 2
+    assert backend.stats() == {'pending': 3, 'inflight': 0, 'nodes': []}
+    assert [backend.claim('node-2')[0] for _ in range(3)] == ['a', 'b', 'c']
+
+
+def test_requeue_returns_one_claimed_task_to_the_front(backend):
+    backend.heartbeat('node-1', 60)
+    backend.enqueue('a', {})
+    backend.enqueue('b', {})
+    backend.enqueue('c', {})
+    backend.claim('node-1')
+    backend.claim('node-1')
+
+    assert backend.requeue('node-1', 'b') is True
+    assert backend.requeue('node-1', 'b') is False
+    assert backend.stats()['inflight'] == 1
+    assert backend.claim('node-2')[0] == 'b'
+
+
+def test_reclaim_only_touches_nodes_without_a_live_heartbeat(backend):
+    backend.enqueue('a', {})
+    backend.enqueue('b', {})
+    backend.heartbeat('live', 60)
+    backend.heartbeat('dead', 60)
+    backend.claim('live')
+    backend.claim('dead')
+    expire_heartbeat(backend, 'dead')
+
+    assert backend.reclaim_dead_nodes() == 1
+    assert backend.claim('live')[0] == 'b'
+    assert backend.stats()['nodes'] == ['live']
+
+
+def test_restarted_node_requeues_tasks_of_its_previous_run(backend, monkeypatch):
+    # The crashed run's heartbeat is still alive, so reclaim_dead_nodes would skip it
+    backend.heartbeat('node-1', 60)
+    backend.enqueue('a', {'url': 'u', 'sitekey': 'k'})
+    backend.claim('node-1')
+    assert backend.reclaim_dead_nodes() == 0
+
+    queue = app.RequestQueue(1)
+    queue.paused = True  # Keep the claim loop from taking the task again
+    monkeypatch.setattr(app, 'request_queue', queue)
+    node = app.ClusterNode(backend, 'node-1', 60)
+    node.start()
+    try:
+        assert backend.stats() == {'pending': 1, 'inflight': 0, 'nodes': ['node-1']}
+    finally:
+        node.stop()
+    assert not any(thread.is_alive() for thread in node.threads)
+
+
+def test_cluster_task_store_round_trips_records(backend):
+    store = app.ClusterTaskStore(backend, ttl=60)
+    store.add('a', 'client')
+    store.update('a', 'ready', token='t', solve_time=1.5)
+
+    record = store.get('a')
+    assert (record.status, record.token, record.solve_time, record.client_key) == ('ready', 't', 1.5, 'client')
+
+    store.pop('a')
+    assert store.get('a') is None
+
+
+def test_completed_task_leaves_the_in_flight_list(backend):
+    backend.heartbeat('node-1', 60)
+    backend.enqueue('a', {})
+    backend.enqueue('b', {})
+    backend.claim('node-1')
+    backend.claim('node-1')
+
+    backend.complete('node-1', 'a')
+    assert backend.stats()['inflight'] == 1
+    assert backend.release('node-1') == 1
+    assert backend.claim('node-2')[0] == 'b'
+
+
+def test_claim_key_returns_the_holder_until_it_is_replaced(backend):
+    assert backend.claim_key('client:idem', 'task-1', 60) is None
+    assert backend.claim_key('client:idem', 'task-2', 60) == 'task-1'
+
+    backend.set_key('client:idem', 'task-2', 60)
+    assert backend.claim_key('client:idem', 'task-3', 60) == 'task-2'
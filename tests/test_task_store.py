@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def test_full_store_evicts_oldest_finished_task_but_keeps_processing_ones():
+    store = app.TaskStore(ttl=60, max_tasks=3)
+    store.add('a', None)
+    store.add('b', None)
+    store.add('c', None)
+    store.update('b', 'ready', token='t')
+
+    store.add('d', None)
+
+    assert 'a' in store and 'b' not in store
+    assert list(store.order) == ['a', 'c', 'd']
+    assert store.evicted == 1
+    assert store.in_flight == 3
+
+
+def test_add_raises_when_every_task_is_still_processing():
+    store = app.TaskStore(ttl=60, max_tasks=2)
+    store.add('a', None)
+    store.add('b', None)
+
+    with pytest.raises(app.TaskStoreFull):
+        store.add('c', None)
+    assert len(store) == 2 and store.in_flight == 2
+
+
+def test_in_flight_follows_add_update_expire_and_pop():
+    store = app.TaskStore(ttl=60, max_tasks=10)
+    for task_id in 'abcd':
+        store.add(task_id, None)
+    assert store.in_flight == 4
+
+    store.update('a', 'ready', token='t')
+    store.update('a', 'ready', fetched=True)  # Already finished, counted out once
+    assert store.in_flight == 3
+
+    store.pop('a')  # Finished
+    store.pop('b')  # Processing
+    store.pop('b')  # Gone already
+    assert store.in_flight == 2
+
+    store.get('c').created = time.monotonic() - 61
+    assert store.expire() == 1
+    assert store.in_flight == 1
+
+    with pytest.raises(ValueError):
+        store.update('c', 'error')
+    assert store.in_flight == 1
+
+    store.update('d', 'error', error='failed')
+    assert store.in_flight == 0